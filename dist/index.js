@@ -617,6 +617,9 @@ var _css = require("./css");
 var _state = require("lit/decorators/state");
 var _d3 = require("d3");
 var _view = require("./view");
+var _network = require("./network");
+// Milliseconds to collect change events before redrawing
+const UPDATE_DELAY = 500;
 class NetworkVisualization extends (0, _lit.LitElement) {
     // Lifecycle interface
     setConfig(config) {
@@ -631,11 +634,33 @@ class NetworkVisualization extends (0, _lit.LitElement) {
     }
     connectedCallback() {
         super.connectedCallback();
+        if (!this._config) return;
+        // Redraw when the server reports a change instead of polling for it
+        if (!this._config.isDemo && typeof EventSource !== "undefined") {
+            this._events = (0, _network.subscribeToChanges)(()=>this._scheduleUpdate());
+            this._events.onerror = ()=>{
+                // The browser gives up if the server doesn't offer the stream at all
+                if (this._events && this._events.readyState === EventSource.CLOSED) {
+                    this._events = undefined;
+                    this._startInterval();
+                }
+            };
+            return;
+        }
+        this._startInterval();
+    }
+    _startInterval() {
         // Start the interval when the component is connected to the DOM
-        if (this._config && this._config.renderInterval) this._intervalId = window.setInterval(()=>{
+        if (this._config && this._config.renderInterval && this._intervalId === undefined) this._intervalId = window.setInterval(()=>{
             this.requestUpdate();
         }, this._config.renderInterval);
     }
+    _scheduleUpdate() {
+        if (this._updateTimeout === undefined) this._updateTimeout = window.setTimeout(()=>{
+            this._updateTimeout = undefined;
+            this.requestUpdate();
+        }, UPDATE_DELAY);
+    }
     disconnectedCallback() {
         super.disconnectedCallback();
         // Clear the interval when the component is disconnected from the DOM
@@ -643,6 +668,15 @@ class NetworkVisualization extends (0, _lit.LitElement) {
             window.clearInterval(this._intervalId);
             this._intervalId = undefined;
         }
+        // Close the event stream and drop a pending update
+        if (this._events !== undefined) {
+            this._events.close();
+            this._events = undefined;
+        }
+        if (this._updateTimeout !== undefined) {
+            window.clearTimeout(this._updateTimeout);
+            this._updateTimeout = undefined;
+        }
     }
     static #_ = (()=>{
         // Declarative part
@@ -714,7 +748,7 @@ class NetworkVisualization extends (0, _lit.LitElement) {
     (0, _state.state)()
 ], NetworkVisualization.prototype, "_config", void 0);
 
-},{"@swc/helpers/_/_ts_decorate":"lX6TJ","lit":"4antt","./css":"bFWtE","lit/decorators/state":"5Z7m1","d3":"17XFv","./view":"1ce4O","@parcel/transformer-js/src/esmodule-helpers.js":"gkKU3"}],"lX6TJ":[function(require,module,exports) {
+},{"@swc/helpers/_/_ts_decorate":"lX6TJ","lit":"4antt","./css":"bFWtE","lit/decorators/state":"5Z7m1","d3":"17XFv","./view":"1ce4O","./network":"5uU8a","@parcel/transformer-js/src/esmodule-helpers.js":"gkKU3"}],"lX6TJ":[function(require,module,exports) {
 var parcelHelpers = require("@parcel/transformer-js/src/esmodule-helpers.js");
 parcelHelpers.defineInteropFlag(exports);
 parcelHelpers.export(exports, "_", ()=>(0, _tslib.__decorate));
@@ -722,19 +756,19 @@ parcelHelpers.export(exports, "_ts_decorate", ()=>(0, _tslib.__decorate));
 var _tslib = require("tslib");
 
 },{"tslib":"lRdW5","@parcel/transformer-js/src/esmodule-helpers.js":"gkKU3"}],"lRdW5":[function(require,module,exports) {
-/******************************************************************************
-Copyright (c) Microsoft Corporation.
-
-Permission to use, copy, modify, and/or distribute this software for any
-purpose with or without fee is hereby granted.
-
-THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
-REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
-AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
-INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
-LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
-OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
-PERFORMANCE OF THIS SOFTWARE.
+/******************************************************************************
+Copyright (c) Microsoft Corporation.
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+PERFORMANCE OF THIS SOFTWARE.
 ***************************************************************************** */ /* global Reflect, Promise */ var parcelHelpers = require("@parcel/transformer-js/src/esmodule-helpers.js");
 parcelHelpers.defineInteropFlag(exports);
 parcelHelpers.export(exports, "__extends", ()=>__extends);
@@ -25458,10 +25492,18 @@ async function generateView(htmlSource, config) {
     };
     // Select the correct devices to be displayed. Used for the demo network
     let devices;
-    devices = !config.isDemo ? config.mode === "physical" ? await _network.getDevicesPhysical(openWrtIP) : await _network.getDevicesSdn(openWrtIP) : config.mode === "physical" ? await _network.getSmallNetwork() // Change here for testing larger networks
-     : await _network.getDemoSdn();
-    // Get the already isolated devices
-    let isolatedDevices = await _network.getIsolatedDevices();
+    let isolatedDevices;
+    if (!config.isDemo) {
+        // Devices and isolated devices come from one consistent server response
+        let topology = await _network.getTopology(openWrtIP, mode, graphForce);
+        devices = topology.devices;
+        isolatedDevices = topology.isolatedDevices;
+    } else {
+        devices = config.mode === "physical" ? await _network.getSmallNetwork() // Change here for testing larger networks
+         : await _network.getDemoSdn();
+        // Get the already isolated devices
+        isolatedDevices = await _network.getIsolatedDevices();
+    }
     try {
         devices.forEach((device)=>{
             let hostname = device.hostname && device.hostname.trim().length > 0 ? device.hostname : "N/A";
@@ -25477,7 +25519,9 @@ async function generateView(htmlSource, config) {
                 name: hostname,
                 ip: ip,
                 mac: mac,
-                reachable: reachable
+                reachable: reachable,
+                x: device.x,
+                y: device.y
             });
             data.links.push({
                 source: host,
@@ -25511,8 +25555,15 @@ async function generateView(htmlSource, config) {
     graphSvg.select("circle[ip='" + vSwtichIP + "']").attr("fill", vSwtichColor);
     // Add physics to the graph
     let simulation = _d3.forceSimulation(data.nodes).force("charge", _d3.forceManyBody().strength(graphForce)).force("center", _d3.forceCenter(graphWidth / 2, graphHeight / 2)).force("link", _d3.forceLink(data.links).id((d)=>d.ip)).force("x", _d3.forceX().x((d)=>Math.max(0, Math.min(graphWidth, d.x))).strength(0.1)).force("y", _d3.forceY().y((d)=>Math.max(0, Math.min(graphHeight, d.y))).strength(0.1)).on("tick", ticked);
-    simulation.alpha(1);
-    for(var i = 0; i < 50; ++i)simulation.tick();
+    // Positions computed by the server are drawn as they are, otherwise the layout is simulated here
+    const positioned = data.nodes.length > 0 && data.nodes.every((node)=>node.x !== undefined && node.y !== undefined);
+    if (positioned) {
+        simulation.stop();
+        ticked();
+    } else {
+        simulation.alpha(1);
+        for(var i = 0; i < 50; ++i)simulation.tick();
+    }
     let drag = _d3.drag().on("start", dragstarted).on("drag", dragged).on("end", dragended);
     nodes.call(drag);
     function ticked() {
@@ -25692,12 +25743,19 @@ async function generateView(htmlSource, config) {
     // Renders the network flow between devices
     async function showCommunication(selectedMac) {
         try {
-            let communications = config.isDemo ? await _network.getDemoCommunications() : await _network.getCommunications();
             let linkedIdentifiers = [];
-            // Get the connected MAC's
-            for (let communication of communications){
-                if (communication.sourceMac.toUpperCase() === selectedMac) linkedIdentifiers.push(communication.destinationMac);
-                else if (communication.destinationMac.toUpperCase() === selectedMac) linkedIdentifiers.push(communication.sourceMac);
+            if (config.isDemo) {
+                let communications = await _network.getDemoCommunications();
+                // Get the connected MAC's
+                for (let communication of communications){
+                    if (communication.sourceMac.toUpperCase() === selectedMac) linkedIdentifiers.push(communication.destinationMac);
+                    else if (communication.destinationMac.toUpperCase() === selectedMac) linkedIdentifiers.push(communication.sourceMac);
+                }
+            } else {
+                // The server looks up the partners of the MAC in its index
+                let partners = await _network.getCommunicationPartners(selectedMac);
+                linkedIdentifiers = partners.map((partner)=>partner.mac);
+                showTraffic(partners);
             }
             // Highlight nodes
             graphSvg.selectAll("circle").filter(function() {
@@ -25707,6 +25765,16 @@ async function generateView(htmlSource, config) {
             console.error("Error generating the connections:", error);
         }
     }
+    // Size the links of the communication partners by the traffic exchanged with them
+    function showTraffic(partners) {
+        let traffic = {};
+        for (let partner of partners)traffic[partner.mac] = partner.bytes_per_second != null ? partner.bytes_per_second : partner.byte_count;
+        let maxTraffic = Math.max(...Object.values(traffic), 0);
+        graphSvg.selectAll("line").filter((link)=>link.target.mac && link.target.mac.toLowerCase() in traffic).transition().duration(duration).style("stroke", linkHighlighted).attr("stroke-width", (link)=>{
+            let share = maxTraffic > 0 ? traffic[link.target.mac.toLowerCase()] / maxTraffic : 1;
+            return linkWidthDefault + (linkWidthHighlighted - linkWidthDefault) * share;
+        }).attr("marked", "true");
+    }
     // Returns the IP of a node or a row
     function getIP(element) {
         if (element.ip) return element.ip;
@@ -25742,19 +25810,21 @@ async function generateView(htmlSource, config) {
  */ // Imports for the demonstrative network
 var parcelHelpers = require("@parcel/transformer-js/src/esmodule-helpers.js");
 parcelHelpers.defineInteropFlag(exports);
-// Retrieve devices from the OpenWRT router
-parcelHelpers.export(exports, "getDevices", ()=>getDevices);
-// Retrieve devices from the OpenWRT router
-parcelHelpers.export(exports, "getDevicesPhysical", ()=>getDevicesPhysical);
-// Retrieve devices from the OpenWRT router
-parcelHelpers.export(exports, "getDevicesSdn", ()=>getDevicesSdn);
-// Retrieve mac-based communications from Open vSwitch
-parcelHelpers.export(exports, "getCommunications", ()=>getCommunications);
+// Retrieve devices, isolated devices and communications in one request
+// The server lays the graph out with the same repulsion as the card
+parcelHelpers.export(exports, "getTopology", ()=>getTopology);
+// Subscribe to the topology changes pushed by the server
+// The browser reconnects by itself and resumes after the last event it received
+parcelHelpers.export(exports, "subscribeToChanges", ()=>subscribeToChanges);
+// Retrieve the MAC addresses the given device communicated with and the traffic with each of them
+parcelHelpers.export(exports, "getCommunicationPartners", ()=>getCommunicationPartners);
 // Retrieve isolated devices from the Open vSwitch
 parcelHelpers.export(exports, "getIsolatedDevices", ()=>getIsolatedDevices);
 // Isolate the device with the given MAC address
+// The flow mod is queued on the server, the response contains the job ID
 parcelHelpers.export(exports, "isolateDeviceByMac", ()=>isolateDeviceByMac);
 // Include the device with the given MAC address
+// The flow mod is queued on the server, the response contains the job ID
 parcelHelpers.export(exports, "includeDeviceByMac", ()=>includeDeviceByMac);
 /*
     The following methods are used for the demo network and testing.
@@ -25781,115 +25851,83 @@ var _communicationsJsonDefault = parcelHelpers.interopDefault(_communicationsJso
 // Contains the api url entry point.
 // Change to homeassistant.local in smart home environment or localhost in docker environment.
 const homeAssistant = "http://localhost:5000";
-function getDevices(openWrtIP) {
-    let processedDeviceList = [];
-    return fetch(homeAssistant + "/devices").then((response)=>response.json())// Push the source node and add other devices to the list
-    .then((deviceList)=>{
-        // todo
-        let sourceNode = {
-            hostname: "OpenWrt",
-            ip: openWrtIP,
-            mac: "--:--:--:--:--:--",
-            reachable: "true",
-            host: "192.168.1.1"
-        };
-        processedDeviceList.push(sourceNode);
-        for (let device of deviceList){
-            let deviceEntry = {
-                hostname: device.hostname,
-                ip: device.ip,
-                mac: device.mac,
-                reachable: device.reachable,
-                host: device.host
-            };
-            processedDeviceList.push(deviceEntry);
-        }
-        return processedDeviceList;
-    }).catch((error)=>{
-        console.error("Error:", error);
-        return processedDeviceList;
-    });
-}
-function getDevicesPhysical(openWrtIP) {
-    let processedDeviceList = [];
-    return fetch(homeAssistant + "/devices").then((response)=>response.json())// Push the source node and add other devices to the list
-    .then((deviceList)=>{
-        let sourceNode = {
-            hostname: "OpenWrt",
-            ip: openWrtIP,
-            mac: "--:--:--:--:--:--",
-            reachable: "true",
-            host: "192.168.1.1"
-        };
-        processedDeviceList.push(sourceNode);
-        for (let device of deviceList){
-            let deviceEntry = {
-                hostname: device.hostname,
-                ip: device.ip,
-                mac: device.mac,
-                reachable: device.reachable,
-                host: device.host
-            };
-            processedDeviceList.push(deviceEntry);
-        }
-        return processedDeviceList;
-    }).catch((error)=>{
-        console.error("Error:", error);
-        return processedDeviceList;
-    });
-}
-function getDevicesSdn(openWrtIP) {
-    let processedDeviceList = [];
-    return fetch(homeAssistant + "/devices").then((response)=>response.json())// Push the source node and add other devices to the list
-    .then((deviceList)=>{
-        let sourceNode = {
+function getTopology(openWrtIP, mode, graphForce) {
+    let topology = {
+        devices: [],
+        isolatedDevices: [],
+        communications: []
+    };
+    return fetch(homeAssistant + "/topology?mode=" + mode + "&charge=" + graphForce).then((response)=>{
+        if (!response.ok) throw new Error("Network response was not ok");
+        return response.json();
+    }).then((topologyData)=>{
+        // Positions of the router and the vSwitch, computed by the server with the devices
+        let hosts = {};
+        for (let host of topologyData.hosts || [])hosts[host.ip] = host;
+        topology.devices.push({
             hostname: "OpenWrt",
             ip: openWrtIP,
             mac: "--:--:--:--:--:--",
             reachable: "true",
-            host: "192.168.1.1"
-        };
-        processedDeviceList.push(sourceNode);
-        let sdnNode = {
+            host: "192.168.1.1",
+            x: hosts[openWrtIP] ? hosts[openWrtIP].x : undefined,
+            y: hosts[openWrtIP] ? hosts[openWrtIP].y : undefined
+        });
+        if (mode !== "physical") topology.devices.push({
             hostname: "vSwitch",
             ip: "---.---.---.---",
             mac: "--:--:--:--:--:--",
             reachable: "true",
-            host: "192.168.1.1"
-        };
-        processedDeviceList.push(sdnNode);
-        for (let device of deviceList){
-            let deviceEntry = {
-                hostname: device.hostname,
-                ip: device.ip,
-                mac: device.mac,
-                reachable: device.reachable,
-                host: device.host
-            };
-            processedDeviceList.push(deviceEntry);
+            host: "192.168.1.1",
+            x: hosts["---.---.---.---"] ? hosts["---.---.---.---"].x : undefined,
+            y: hosts["---.---.---.---"] ? hosts["---.---.---.---"].y : undefined
+        });
+        for (let node of topologyData.nodes){
+            topology.devices.push({
+                hostname: node.hostname,
+                ip: node.ip,
+                mac: node.mac,
+                reachable: node.reachable,
+                host: node.host,
+                x: node.x,
+                y: node.y
+            });
+            if (node.isolated) topology.isolatedDevices.push(node.mac.toLowerCase());
         }
-        return processedDeviceList;
+        for (let edge of topologyData.edges)topology.communications.push({
+            sourceMac: edge.source_mac,
+            destinationMac: edge.destination_mac
+        });
+        return topology;
     }).catch((error)=>{
         console.error("Error:", error);
-        return processedDeviceList;
-    });
+        return topology;
+    });
+}
+// Event types of the server that change what the card shows
+const changeEvents = [
+    "device-joined",
+    "device-left",
+    "ip-changed",
+    "hostname-changed",
+    "reachability-changed",
+    "isolation-changed",
+    "communication-added",
+    "job-finished",
+    "resync"
+];
+function subscribeToChanges(onChange) {
+    const source = new EventSource(homeAssistant + "/events");
+    for (let type of changeEvents)source.addEventListener(type, ()=>onChange(type));
+    return source;
 }
-function getCommunications() {
-    let communicationList = [];
-    return fetch(homeAssistant + "/communications").then((response)=>response.json()).then((communicationData)=>{
-        // Process the communicationData as needed
-        for (let communication of communicationData){
-            let communicationEntry = {
-                sourceMac: communication.source_mac,
-                destinationMac: communication.destination_mac
-            };
-            communicationList.push(communicationEntry);
-        }
-        return communicationList;
+function getCommunicationPartners(selectedMac) {
+    return fetch(homeAssistant + "/communications/" + encodeURIComponent(selectedMac) + "?traffic=1").then((response)=>{
+        if (!response.ok) throw new Error("Network response was not ok");
+        return response.json();
     }).catch((error)=>{
-        // Handle any errors that occur during the request
         console.error("Error:", error);
-        return communicationList;
+        return [];
     });
 }
 function getIsolatedDevices() {
@@ -25904,7 +25942,7 @@ function getIsolatedDevices() {
     });
 }
 function isolateDeviceByMac(selectedMac) {
-    return fetch(homeAssistant + "/isolate_mac/" + selectedMac, {
+    return fetch(homeAssistant + "/isolate_mac/" + selectedMac + "?async=1", {
         method: "POST"
     }).then((response)=>response.json()).catch((error)=>{
         // Handle any errors that occur during the request
@@ -25912,7 +25950,7 @@ function isolateDeviceByMac(selectedMac) {
     });
 }
 function includeDeviceByMac(selectedMac) {
-    return fetch(homeAssistant + "/include_mac/" + selectedMac, {
+    return fetch(homeAssistant + "/include_mac/" + selectedMac + "?async=1", {
         method: "POST"
     }).then((response)=>response.json()).catch((error)=>{
         // Handle any errors that occur during the request
@@ -19,9 +19,13 @@ import { styles } from "./css";
 import { state } from "lit/decorators/state";
 import * as d3 from "d3";
 import { generateView } from './view';
+import { subscribeToChanges } from './network';
 
 import { HomeAssistant, LovelaceCardConfig } from "custom-card-helpers";
 
+// Milliseconds to collect change events before redrawing
+const UPDATE_DELAY = 500;
+
 interface Config extends LovelaceCardConfig {
   header: string;
   entity: string;
@@ -38,9 +42,15 @@ export class NetworkVisualization extends LitElement {
   // Private property
   private _hass: HomeAssistant;
 
-  // The interval for updating the svg
+  // The interval for updating the svg, used for the demo network or without event stream
   private _intervalId?: number;
 
+  // The stream of topology changes pushed by the server
+  private _events?: EventSource;
+
+  // Pending update, the changes of one snapshot arrive as several events
+  private _updateTimeout?: number;
+
 
   // Lifecycle interface
   public setConfig(config: Config) {
@@ -61,14 +71,44 @@ export class NetworkVisualization extends LitElement {
   connectedCallback(): void {
     super.connectedCallback();
 
+    if (!this._config) {
+      return;
+    }
+
+    // Redraw when the server reports a change instead of polling for it
+    if (!this._config.isDemo && typeof EventSource !== "undefined") {
+      this._events = subscribeToChanges(() => this._scheduleUpdate());
+      this._events.onerror = () => {
+        // The browser gives up if the server doesn't offer the stream at all
+        if (this._events && this._events.readyState === EventSource.CLOSED) {
+          this._events = undefined;
+          this._startInterval();
+        }
+      };
+      return;
+    }
+
+    this._startInterval();
+  }
+
+  private _startInterval(): void {
     // Start the interval when the component is connected to the DOM
-    if (this._config && this._config.renderInterval) {
+    if (this._config && this._config.renderInterval && this._intervalId === undefined) {
       this._intervalId = window.setInterval(() => {
         this.requestUpdate();
       }, this._config.renderInterval);
     }
   }
 
+  private _scheduleUpdate(): void {
+    if (this._updateTimeout === undefined) {
+      this._updateTimeout = window.setTimeout(() => {
+        this._updateTimeout = undefined;
+        this.requestUpdate();
+      }, UPDATE_DELAY);
+    }
+  }
+
   disconnectedCallback(): void {
     super.disconnectedCallback();
 
@@ -77,6 +117,16 @@ export class NetworkVisualization extends LitElement {
       window.clearInterval(this._intervalId);
       this._intervalId = undefined;
     }
+
+    // Close the event stream and drop a pending update
+    if (this._events !== undefined) {
+      this._events.close();
+      this._events = undefined;
+    }
+    if (this._updateTimeout !== undefined) {
+      window.clearTimeout(this._updateTimeout);
+      this._updateTimeout = undefined;
+    }
   }
 
   // Declarative part
@@ -24,143 +24,115 @@ import communicationData from "./demo/communications.json";
 // Change to homeassistant.local in smart home environment or localhost in docker environment.
 const homeAssistant = "http://localhost:5000";
 
-// Retrieve devices from the OpenWRT router
-export function getDevices(openWrtIP) {
-    let processedDeviceList = [];
+// Retrieve devices, isolated devices and communications in one request
+// The server lays the graph out with the same repulsion as the card
+export function getTopology(openWrtIP, mode, graphForce) {
+    let topology = {
+        devices: [],
+        isolatedDevices: [],
+        communications: []
+    };
 
-    return fetch(homeAssistant + '/devices')
-        .then(response => response.json())
-
-        // Push the source node and add other devices to the list
-        .then(deviceList => {
-            // todo
-            let sourceNode = {
-                hostname: "OpenWrt",
-                ip: openWrtIP,
-                mac: "--:--:--:--:--:--",
-                reachable: "true",
-                host: "192.168.1.1"
-            };
-            processedDeviceList.push(sourceNode)
-            for (let device of deviceList) {
-                let deviceEntry = {
-                    hostname: device.hostname,
-                    ip: device.ip,
-                    mac: device.mac,
-                    reachable: device.reachable,
-                    host: device.host
-                };
-                processedDeviceList.push(deviceEntry);
+    return fetch(homeAssistant + '/topology?mode=' + mode + '&charge=' + graphForce)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok');
             }
-            return processedDeviceList;
+            return response.json();
         })
-        .catch(error => {
-            console.error('Error:', error);
-            return processedDeviceList;
-        });
-}
-
-// Retrieve devices from the OpenWRT router
-export function getDevicesPhysical(openWrtIP) {
-    let processedDeviceList = [];
-
-    return fetch(homeAssistant + '/devices')
-        .then(response => response.json())
-
-        // Push the source node and add other devices to the list
-        .then(deviceList => {
-            let sourceNode = {
-                hostname: "OpenWrt",
-                ip: openWrtIP,
-                mac: "--:--:--:--:--:--",
-                reachable: "true",
-                host: "192.168.1.1"
-            };
-            processedDeviceList.push(sourceNode)
-            for (let device of deviceList) {
-                let deviceEntry = {
-                    hostname: device.hostname,
-                    ip: device.ip,
-                    mac: device.mac,
-                    reachable: device.reachable,
-                    host: device.host
-                };
-                processedDeviceList.push(deviceEntry);
+        .then(topologyData => {
+            // Positions of the router and the vSwitch, computed by the server with the devices
+            let hosts = {};
+            for (let host of topologyData.hosts || []) {
+                hosts[host.ip] = host;
             }
-            return processedDeviceList;
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            return processedDeviceList;
-        });
-}
-
-// Retrieve devices from the OpenWRT router
-export function getDevicesSdn(openWrtIP) {
-    let processedDeviceList = [];
-
-    return fetch(homeAssistant + '/devices')
-        .then(response => response.json())
 
-        // Push the source node and add other devices to the list
-        .then(deviceList => {
-            let sourceNode = {
+            topology.devices.push({
                 hostname: "OpenWrt",
                 ip: openWrtIP,
                 mac: "--:--:--:--:--:--",
                 reachable: "true",
-                host: "192.168.1.1"
-            };
-            processedDeviceList.push(sourceNode)
+                host: "192.168.1.1",
+                x: hosts[openWrtIP] ? hosts[openWrtIP].x : undefined,
+                y: hosts[openWrtIP] ? hosts[openWrtIP].y : undefined
+            });
 
-            let sdnNode = {
-                hostname: "vSwitch",
-                ip: "---.---.---.---",
-                mac: "--:--:--:--:--:--",
-                reachable: "true",
-                host: "192.168.1.1"
-            };
-            processedDeviceList.push(sdnNode)
+            if (mode !== "physical") {
+                topology.devices.push({
+                    hostname: "vSwitch",
+                    ip: "---.---.---.---",
+                    mac: "--:--:--:--:--:--",
+                    reachable: "true",
+                    host: "192.168.1.1",
+                    x: hosts["---.---.---.---"] ? hosts["---.---.---.---"].x : undefined,
+                    y: hosts["---.---.---.---"] ? hosts["---.---.---.---"].y : undefined
+                });
+            }
+
+            for (let node of topologyData.nodes) {
+                topology.devices.push({
+                    hostname: node.hostname,
+                    ip: node.ip,
+                    mac: node.mac,
+                    reachable: node.reachable,
+                    host: node.host,
+                    x: node.x,
+                    y: node.y
+                });
+                if (node.isolated) {
+                    topology.isolatedDevices.push(node.mac.toLowerCase());
+                }
+            }
 
-            for (let device of deviceList) {
-                let deviceEntry = {
-                    hostname: device.hostname,
-                    ip: device.ip,
-                    mac: device.mac,
-                    reachable: device.reachable,
-                    host: device.host
-                };
-                processedDeviceList.push(deviceEntry);
+            for (let edge of topologyData.edges) {
+                topology.communications.push({
+                    sourceMac: edge.source_mac,
+                    destinationMac: edge.destination_mac
+                });
             }
-            return processedDeviceList;
+            return topology;
         })
         .catch(error => {
             console.error('Error:', error);
-            return processedDeviceList;
+            return topology;
         });
 }
 
-// Retrieve mac-based communications from Open vSwitch
-export function getCommunications() {
-    let communicationList = [];
+// Event types of the server that change what the card shows
+const changeEvents = [
+    "device-joined",
+    "device-left",
+    "ip-changed",
+    "hostname-changed",
+    "reachability-changed",
+    "isolation-changed",
+    "communication-added",
+    "job-finished",
+    "resync"
+];
 
-    return fetch(homeAssistant + '/communications')
-        .then(response => response.json())
-        .then(communicationData => {
-            // Process the communicationData as needed
-            for (let communication of communicationData) {
-                let communicationEntry = {
-                    sourceMac: communication.source_mac,
-                    destinationMac: communication.destination_mac
-                };
-                communicationList.push(communicationEntry);
+// Subscribe to the topology changes pushed by the server
+// The browser reconnects by itself and resumes after the last event it received
+export function subscribeToChanges(onChange) {
+    const source = new EventSource(homeAssistant + '/events');
+    for (let type of changeEvents) {
+        source.addEventListener(type, () => onChange(type));
+    }
+    return source;
+}
+
+// Retrieve the MAC addresses the given device communicated with and the traffic with each of them
+export function getCommunicationPartners(selectedMac) {
+    return fetch(homeAssistant + '/communications/' + encodeURIComponent(selectedMac) + '?traffic=1')
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok');
             }
-            return communicationList;
+            return response.json();
         })
         .catch(error => {
-            // Handle any errors that occur during the request
             console.error('Error:', error);
-            return communicationList;
+            return [];
         });
 }
 
@@ -183,8 +155,9 @@ export function getIsolatedDevices() {
 }
 
 // Isolate the device with the given MAC address
+// The flow mod is queued on the server, the response contains the job ID
 export function isolateDeviceByMac(selectedMac) {
-    return fetch(homeAssistant + '/isolate_mac/' + selectedMac, {
+    return fetch(homeAssistant + '/isolate_mac/' + selectedMac + '?async=1', {
         method: 'POST'
     })
         .then(response => response.json())
@@ -195,8 +168,9 @@ export function isolateDeviceByMac(selectedMac) {
 }
 
 // Include the device with the given MAC address
+// The flow mod is queued on the server, the response contains the job ID
 export function includeDeviceByMac(selectedMac) {
-    return fetch(homeAssistant + '/include_mac/' + selectedMac, {
+    return fetch(homeAssistant + '/include_mac/' + selectedMac + '?async=1', {
         method: 'POST'
     })
         .then(response => response.json())
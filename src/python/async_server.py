@@ -0,0 +1,525 @@
+"""
+async_server.py - asyncio serving mode of the API server.
+
+The read endpoints and the event stream are served by an ASGI application with
+asynchronous upstream clients, so waiting on the router or Ryu does not occupy a worker
+thread and hundreds of requests can be in flight at once. Independent upstream calls
+run concurrently. All other routes are passed on to the Flask app of server.py, so both
+modes serve the same URLs and payloads.
+
+Requires uvicorn, httpx and asgiref. Start with: python async_server.py
+"""
+
+import asyncio
+import json
+import re
+from urllib.parse import parse_qsl, unquote
+
+import httpx
+import requests
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import MultiDict
+
+import server
+from responses import is_rendered, render
+from ryu_api import DatapathNotFound
+from snapshots import AsyncSnapshotCache, FlowSnapshot, IsolationSnapshot
+
+# Errors of the flow-based endpoints, answered with a JSON error instead of a bare 500
+# The synchronous client is used when flow dumps are streamed
+FLOW_ERRORS = (DatapathNotFound, httpx.HTTPError, requests.RequestException, ValueError)
+
+# Sent with every natively served response, as Flask-CORS does for the Flask routes
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Expose-Headers": "ETag, X-Snapshot-Age, X-Snapshot-Version",
+}
+
+
+class AsyncRyuClient:
+    """
+    Asynchronous counterpart of RyuClient with a bounded keep-alive pool and explicit timeouts.
+    """
+
+    def __init__(self, base_url, pool_size=10, connect_timeout=3, read_timeout=10):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+
+        self.client = None
+        self._requests = 0
+        self._errors = 0
+
+    async def start(self):
+        """
+        Create the connection pool, has to run inside the event loop.
+        """
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+            ),
+        )
+
+    async def close(self):
+        """
+        Close all pooled connections.
+        """
+        if self.client is not None:
+            await self.client.aclose()
+
+    async def get(self, path, **kwargs):
+        """
+        Send a GET request to the given path of the Ryu REST API.
+        """
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        """
+        Send a POST request to the given path of the Ryu REST API.
+        """
+        return await self.request("POST", path, **kwargs)
+
+    async def request(self, method, path, **kwargs):
+        """
+        Send a request over the pooled client.
+        """
+        self._requests += 1
+        try:
+            return await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self._errors += 1
+            raise
+
+    def stats(self):
+        """
+        Return the request counters of the client.
+        """
+        return {
+            "requests": self._requests,
+            "errors": self._errors,
+            "max_connections": self.pool_size,
+        }
+
+
+ryu = AsyncRyuClient(
+    server.ryu.base_url,
+    pool_size=server.secrets.get("ryu_pool_size", 10),
+    connect_timeout=server.ryu.timeout[0],
+    read_timeout=server.ryu.timeout[1],
+)
+
+
+async def resolve_dpids():
+    """
+    Return the DPIDs of all switches, the registry only blocks if its cache is empty.
+    """
+    dpids = await asyncio.to_thread(server.get_switch_dpids)
+    if not dpids:
+        raise DatapathNotFound()
+    return dpids
+
+
+async def fetch_devices():
+    """
+    Retrieve all devices connected to the router.
+
+    The LuCI client is synchronous and runs in a worker thread.
+    """
+    return await asyncio.to_thread(server.fetch_device_snapshot)
+
+
+async def fetch_flows():
+    """
+    Download and parse the flow tables of all switches concurrently.
+    """
+    if server.STREAM_FLOW_DUMPS:
+        # The incremental parser reads from the synchronous client
+        return await asyncio.to_thread(server.fetch_flow_snapshot)
+
+    dpids = await resolve_dpids()
+    results = await asyncio.gather(
+        *(fetch_datapath_flows(dpid) for dpid in dpids), return_exceptions=True
+    )
+    for result in results:
+        if not isinstance(result, (FlowSnapshot, httpx.HTTPError, ValueError)):
+            raise result
+
+    # Diffing, rates and history updates take a lock the collector may be holding
+    return await asyncio.to_thread(
+        lambda: server.publish_flow_snapshot(
+            server.merge_datapath_snapshots(dict(zip(dpids, results)))
+        )
+    )
+
+
+async def fetch_datapath_flows(dpid):
+    """
+    Download and parse the flow table of one switch.
+    """
+    response = await ryu.get(f"/stats/flow/{dpid}")
+    server.check_datapath(response)
+    response.raise_for_status()
+
+    # Parsing a large table would block the event loop
+    return await asyncio.to_thread(
+        lambda: FlowSnapshot(dpid, response.json().get(str(dpid), []))
+    )
+
+
+async def fetch_isolation():
+    """
+    Fetch only the isolation rules of all switches, falling back to the full flow tables.
+    """
+    dpids = await resolve_dpids()
+    try:
+        snapshots = await asyncio.gather(
+            *(fetch_datapath_isolation(dpid) for dpid in dpids)
+        )
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Filtered flow query failed, scanning the full flow table: {e}")
+        snapshot = await flow_cache.get()
+        return IsolationSnapshot(snapshot.dpids, snapshot.isolated_macs)
+
+    return IsolationSnapshot.merge(snapshots)
+
+
+async def fetch_datapath_isolation(dpid):
+    """
+    Fetch the isolation rules of one switch with a filtered flow query.
+    """
+    response = await ryu.post(f"/stats/flow/{dpid}", json=server.ISOLATION_FILTER)
+    server.check_datapath(response)
+    response.raise_for_status()
+    flows = response.json()
+    return IsolationSnapshot.from_flows(dpid, flows.get(str(dpid), []))
+
+
+# Concurrent requests share one in-flight fetch and its snapshot, like in server.py
+device_cache = AsyncSnapshotCache(fetch_devices, ttl=server.device_cache.ttl)
+flow_cache = AsyncSnapshotCache(fetch_flows, ttl=server.flow_cache.ttl)
+isolation_cache = AsyncSnapshotCache(fetch_isolation, ttl=server.isolation_cache.ttl)
+
+# Flow mods are handled by the Flask routes, which invalidate these caches as well
+server.flow_invalidation_hooks.append(flow_cache.invalidate)
+server.flow_invalidation_hooks.append(isolation_cache.invalidate)
+
+
+async def current_devices():
+    """
+    Return the latest device snapshot, from the collector if it is enabled.
+    """
+    if server.COLLECTOR_ENABLED:
+        snapshot = server.collector.latest("devices")
+        if snapshot is not None:
+            return snapshot
+    return await device_cache.get()
+
+
+async def current_flows():
+    """
+    Return the latest flow snapshot, from the collector if it is enabled.
+    """
+    if server.COLLECTOR_ENABLED:
+        snapshot = server.collector.latest("flows")
+        if snapshot is not None:
+            return snapshot
+    return await flow_cache.get()
+
+
+async def current_isolation():
+    """
+    Return the latest snapshot of the isolated devices, from the collector if it is enabled.
+    """
+    if server.COLLECTOR_ENABLED:
+        snapshot = server.collector.latest("flows")
+        if snapshot is not None:
+            return snapshot
+    return await isolation_cache.get()
+
+
+class Request:
+    """
+    The parts of an ASGI request the handlers need.
+    """
+
+    def __init__(self, scope, receive, send, params):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.params = params
+        self.headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        self.args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1")))
+
+
+async def send_response(request, status, headers, body):
+    """
+    Send a complete response with the CORS headers.
+    """
+    headers = {**headers, **CORS_HEADERS}
+    await request.send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (name.lower().encode("latin-1"), str(value).encode("latin-1"))
+                for name, value in headers.items()
+            ],
+        }
+    )
+    await request.send({"type": "http.response.body", "body": body})
+
+
+async def send_json(request, status, payload):
+    """
+    Send a JSON payload that is not derived from a snapshot, e.g. an error.
+    """
+    body = json.dumps(payload).encode("utf-8")
+    await send_response(request, status, {"Content-Type": "application/json"}, body)
+
+
+async def send_snapshot(request, snapshot, key, build):
+    """
+    Send a snapshot-backed payload with ETag, compression and age headers.
+
+    The first request for a payload serializes and compresses it in a worker thread,
+    later requests for the same snapshot are answered from the cached body directly.
+    """
+    accept_encoding = request.headers.get("accept-encoding")
+    min_size = server.app.config["COMPRESSION_MIN_SIZE"]
+
+    def render_response():
+        return render(
+            snapshot,
+            key,
+            build,
+            if_none_match=request.headers.get("if-none-match"),
+            accept_encoding=accept_encoding,
+            min_size=min_size,
+        )
+
+    if is_rendered(snapshot, key, accept_encoding, min_size):
+        status, headers, body = render_response()
+    else:
+        status, headers, body = await asyncio.to_thread(render_response)
+    await send_response(request, status, headers, body)
+
+
+async def send_flow_error(request, error):
+    """
+    Send the error responses of the flow-based endpoints.
+    """
+    if isinstance(error, DatapathNotFound):
+        print("No DPID found.")
+        message = "No DPID found."
+    else:
+        print(f"Error during GET request: {error}")
+        message = str(error)
+    await send_json(request, 500, {"status": "error", "message": message})
+
+
+async def get_devices(request):
+    try:
+        snapshot = await current_devices()
+    except Exception as error:
+        print(f"Failed to retrieve devices: {str(error)}")
+        await send_json(request, 500, {"error": str(error)})
+        return
+    await send_snapshot(request, snapshot, *server.devices_view(snapshot, request.args))
+
+
+async def get_communications(request):
+    try:
+        snapshot = await current_flows()
+    except FLOW_ERRORS as error:
+        await send_flow_error(request, error)
+        return
+    await send_snapshot(
+        request, snapshot, *server.communications_view(snapshot, request.args)
+    )
+
+
+async def get_communication_partners(request):
+    try:
+        snapshot = await current_flows()
+    except FLOW_ERRORS as error:
+        await send_flow_error(request, error)
+        return
+    mac_address = unquote(request.params["mac_address"])
+    await send_snapshot(
+        request, snapshot, *server.peers_view(snapshot, mac_address, request.args)
+    )
+
+
+async def get_isolated_devices(request):
+    try:
+        snapshot = await current_isolation()
+    except FLOW_ERRORS as error:
+        await send_flow_error(request, error)
+        return
+    await send_snapshot(request, snapshot, *server.isolation_view(snapshot))
+
+
+async def get_topology(request):
+    try:
+        charge = server.layout_charge(request.args)
+    except ValueError as error:
+        await send_json(request, 400, {"status": "error", "message": str(error)})
+        return
+
+    try:
+        device_snapshot, flow_snapshot = await asyncio.gather(
+            current_devices(), current_flows()
+        )
+    except DatapathNotFound as error:
+        await send_flow_error(request, error)
+        return
+    except Exception as error:
+        print(f"Failed to retrieve topology: {error}")
+        await send_json(request, 500, {"status": "error", "message": str(error)})
+        return
+    snapshot = server.topology_snapshot(device_snapshot, flow_snapshot)
+    if server.LAYOUT_ENABLED:
+        # Computed off the event loop, the payload builder takes it from the snapshot
+        software = request.args.get("mode") == "software"
+        await asyncio.to_thread(server.topology_layout, snapshot, software, charge)
+    await send_snapshot(
+        request, snapshot, *server.topology_view(snapshot, request.args)
+    )
+
+
+async def get_datapaths(request):
+    try:
+        snapshot = await current_flows()
+    except FLOW_ERRORS as error:
+        await send_flow_error(request, error)
+        return
+    await send_json(request, 200, snapshot.datapaths())
+
+
+async def get_upstream_stats(request):
+    stats = server.upstream_stats()
+    stats["ryu_async"] = ryu.stats()
+    await send_json(request, 200, stats)
+
+
+async def get_events(request):
+    last_event_id = request.headers.get("last-event-id") or request.args.get(
+        "last_event_id"
+    )
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    # The stream only notices a closed connection through the disconnect message
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    stream = server.events.astream(last_event_id)
+    try:
+        headers = {
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            **CORS_HEADERS,
+        }
+        await request.send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers.items()
+                ],
+            }
+        )
+        async for message in stream:
+            if disconnected.is_set():
+                break
+            await request.send(
+                {
+                    "type": "http.response.body",
+                    "body": message.encode("utf-8"),
+                    "more_body": True,
+                }
+            )
+    finally:
+        watcher.cancel()
+        await stream.aclose()
+
+
+ROUTES = [
+    (re.compile(r"^/devices$"), get_devices),
+    (re.compile(r"^/communications$"), get_communications),
+    (re.compile(r"^/communications/(?P<mac_address>[^/]+)$"), get_communication_partners),
+    (re.compile(r"^/isolated_devices$"), get_isolated_devices),
+    (re.compile(r"^/topology$"), get_topology),
+    (re.compile(r"^/datapaths$"), get_datapaths),
+    (re.compile(r"^/upstream_stats$"), get_upstream_stats),
+    (re.compile(r"^/events$"), get_events),
+]
+
+
+class AsyncApp:
+    """
+    ASGI application serving the read routes natively and all others through Flask.
+    """
+
+    def __init__(self):
+        self.flask = WsgiToAsgi(server.app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+
+        if scope["type"] == "http" and scope["method"] == "GET":
+            for pattern, handler in ROUTES:
+                match = pattern.match(scope["path"])
+                if match:
+                    await handler(Request(scope, receive, send, match.groupdict()))
+                    return
+
+        await self.flask(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await ryu.start()
+                asyncio.ensure_future(self.warm_up())
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await ryu.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def warm_up(self):
+        """
+        Fetch devices, flows and isolated devices concurrently, so the first requests are served from cache.
+        """
+        await asyncio.gather(
+            current_devices(),
+            current_flows(),
+            current_isolation(),
+            return_exceptions=True,
+        )
+
+
+app = AsyncApp()
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,132 @@
+"""
+bench_flow_parser.py - Benchmark of the peak memory used to parse Ryu flow dumps.
+
+Generates synthetic /stats/flow dumps of increasing size and parses each of them in a
+fresh process, once by loading the whole document like response.json() and once with
+the incremental parser. The peak RSS of every run is printed as a table, together with
+a pass of the incremental parser alone, without building the snapshot.
+
+Usage: python bench_flow_parser.py [flow counts...]
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from flow_parser import iter_flows
+from snapshots import FlowSnapshot
+
+DPID = 251096700645801
+CHUNK_SIZE = 64 * 1024
+DEFAULT_SIZES = [1000, 10000, 50000, 100000]
+
+
+def generate_dump(path, count):
+    """
+    Write a flow dump with `count` learned flows, similar to what ofctl_rest returns.
+    """
+    with open(path, "w") as file:
+        file.write(f'{{"{DPID}": [')
+        for index in range(count):
+            src = index % 250
+            dst = (index * 7 + 3) % 250
+            flow = {
+                "priority": 1,
+                "cookie": 0,
+                "idle_timeout": 0,
+                "hard_timeout": 0,
+                "byte_count": index * 98,
+                "duration_sec": index % 3600,
+                "duration_nsec": 123000000,
+                "packet_count": index,
+                "length": 112,
+                "flags": 0,
+                "table_id": 0,
+                "actions": [f"OUTPUT:{index % 4 + 1}"],
+                "match": {
+                    "in_port": index % 4 + 1,
+                    "dl_src": f"02:00:00:00:{src // 256:02x}:{src % 256:02x}",
+                    "dl_dst": f"02:00:00:01:{dst // 256:02x}:{dst % 256:02x}",
+                },
+            }
+            if index:
+                file.write(", ")
+            file.write(json.dumps(flow))
+        file.write("]}")
+
+
+def parse(mode, path):
+    """
+    Parse a dump into a flow snapshot and return the number of communications.
+
+    The mode "scan" only walks the flows and returns their number.
+    """
+    if mode == "scan":
+        with open(path, "rb") as file:
+            chunks = iter(lambda: file.read(CHUNK_SIZE), b"")
+            return sum(1 for _ in iter_flows(chunks, DPID))
+    if mode == "json":
+        with open(path, "rb") as file:
+            flows = json.loads(file.read())
+        snapshot = FlowSnapshot(DPID, flows.get(str(DPID), []))
+    else:
+        with open(path, "rb") as file:
+            chunks = iter(lambda: file.read(CHUNK_SIZE), b"")
+            snapshot = FlowSnapshot(DPID, iter_flows(chunks, DPID))
+    return len(snapshot.communications)
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(mode, path):
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    count = parse(mode, path)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({"peak": peak_rss_mb(), "baseline": baseline, "time": elapsed, "count": count}))
+
+
+def main(sizes):
+    print(
+        f"{'flows':>8} {'dump MB':>8} {'json MB':>9} {'stream MB':>10} {'scan MB':>8} "
+        f"{'json s':>8} {'stream s':>9}"
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        for count in sizes:
+            path = os.path.join(directory, f"flows-{count}.json")
+            generate_dump(path, count)
+
+            results = {}
+            for mode in ("json", "stream", "scan"):
+                output = subprocess.run(
+                    [sys.executable, __file__, "--child", mode, path],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout
+                results[mode] = json.loads(output)
+
+            size = os.path.getsize(path) / (1024 * 1024)
+            used = {
+                mode: result["peak"] - result["baseline"] for mode, result in results.items()
+            }
+            print(
+                f"{count:>8} {size:>8.1f} {used['json']:>9.1f} {used['stream']:>10.1f} "
+                f"{used['scan']:>8.1f} "
+                f"{results['json']['time']:>8.2f} {results['stream']['time']:>9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        run_child(sys.argv[2], sys.argv[3])
+    else:
+        main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
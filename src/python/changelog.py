@@ -0,0 +1,80 @@
+"""
+changelog.py - Versioned change log of keyed records, used for incremental responses.
+
+Every published set of changes gets a version. Clients that already know a version
+only receive the records added, removed and changed since then. The changes are
+computed by the caller, once per snapshot.
+"""
+
+import threading
+from collections import deque
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+
+class ChangeLog:
+    """
+    Bounded log of the changes between consecutive lists of records.
+
+    Only the changes of the last `max_versions` versions are kept, older versions have
+    to be answered with the full list.
+    """
+
+    def __init__(self, max_versions=100):
+        self.version = 0
+
+        self._entries = deque(maxlen=max_versions)
+        self._lock = threading.Lock()
+
+    def publish_changes(self, changes):
+        """
+        Record changes computed by the caller and return the resulting version.
+
+        `changes` maps the key of every added, removed or changed record to
+        (kind, record), relative to the records published before. The version is only
+        increased if anything changed.
+        """
+        with self._lock:
+            if changes:
+                self.version += 1
+                self._entries.append((self.version, changes))
+            return self.version
+
+    def changes(self, since, until):
+        """
+        Return the records added, removed and changed between two versions.
+
+        Returns None if `since` is no longer covered by the log, or is not a known version.
+        """
+        with self._lock:
+            # Versions that were never published are unknown, even if since == until
+            if since == until and 0 <= since <= self.version:
+                return {ADDED: [], REMOVED: [], CHANGED: []}
+
+            oldest = self._entries[0][0] if self._entries else self.version + 1
+            if since < oldest - 1 or since > until or until > self.version:
+                return None
+
+            # The first change of a key tells whether it existed at `since`
+            first = {}
+            last = {}
+            for version, changes in self._entries:
+                if version <= since or version > until:
+                    continue
+                for key, change in changes.items():
+                    first.setdefault(key, change)
+                    last[key] = change
+
+        result = {ADDED: [], REMOVED: [], CHANGED: []}
+        for key, (kind, record) in last.items():
+            existed = first[key][0] != ADDED
+            exists = kind != REMOVED
+            if existed and exists:
+                result[CHANGED].append(record)
+            elif exists:
+                result[ADDED].append(record)
+            elif existed:
+                result[REMOVED].append(record)
+        return result
@@ -0,0 +1,127 @@
+"""
+collector.py - Background collection of the upstream state.
+
+In collector mode the router and the Ryu controller are polled on fixed intervals and
+the read endpoints answer from the latest published snapshot, so their latency no
+longer depends on the latency of the upstream systems.
+"""
+
+import threading
+import time
+
+
+class _Source:
+    """
+    A polled upstream source and its latest snapshot.
+    """
+
+    def __init__(self, name, fetch, interval):
+        self.name = name
+        self.fetch = fetch
+        self.interval = interval
+        self.snapshot = None
+        self.error = None
+        self.wake = threading.Event()
+
+        # Set once the first poll finished, successful or not
+        self.ready = threading.Event()
+
+
+class Collector:
+    """
+    Polls every registered source on its own interval and publishes its snapshots.
+
+    Each source is polled by its own thread, so a slow router does not delay the
+    collection of the flow table. Failed polls keep the previous snapshot, which then
+    simply grows older.
+    """
+
+    def __init__(self):
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._active = None
+
+    def add_source(self, name, fetch, interval):
+        """
+        Register a source, `fetch` is called every `interval` seconds and returns a snapshot.
+        """
+        self._sources[name] = _Source(name, fetch, interval)
+
+    def start(self, active=None):
+        """
+        Start one polling thread per source.
+
+        If given, `active()` is asked before every poll and the poll is skipped while it
+        returns False.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._active = active
+
+        for source in self._sources.values():
+            thread = threading.Thread(
+                target=self._poll, args=(source,), name=f"collector-{source.name}", daemon=True
+            )
+            thread.start()
+
+    def wait_ready(self, timeout=None):
+        """
+        Wait until every source finished its first poll.
+
+        Returns whether all sources did so within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for source in self._sources.values():
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+            if not source.ready.wait(remaining):
+                return False
+        return True
+
+    def latest(self, name):
+        """
+        Return the latest snapshot of a source, or None if nothing was published yet.
+        """
+        return self._sources[name].snapshot
+
+    def refresh(self, name=None):
+        """
+        Poll a source, or all sources, right away instead of waiting for their interval.
+        """
+        names = [name] if name is not None else list(self._sources)
+        for name in names:
+            self._sources[name].wake.set()
+
+    def status(self):
+        """
+        Return age and last error of every source.
+        """
+        return {
+            name: {
+                "interval": source.interval,
+                "age": source.snapshot.age() if source.snapshot else None,
+                "error": source.error,
+            }
+            for name, source in self._sources.items()
+        }
+
+    def _poll(self, source):
+        while True:
+            started = time.monotonic()
+
+            # Cleared before polling, so a refresh requested meanwhile polls again
+            source.wake.clear()
+            if self._active is None or self._active():
+                try:
+                    source.snapshot = source.fetch()
+                    source.error = None
+                except Exception as error:
+                    print(f"Failed to collect {source.name}: {str(error)}")
+                    source.error = str(error)
+                source.ready.set()
+
+            source.wake.wait(max(source.interval - (time.monotonic() - started), 0))
@@ -0,0 +1,77 @@
+"""
+columnar.py - Compact columnar representation of device and communication lists.
+
+Instead of an array of objects repeating every key, a columnar payload has one array
+per field. Fields with few distinct values, like the host of a device or the MACs of
+communications, are stored as indexes into a dictionary of their distinct values.
+
+    {
+        "format": "columnar",
+        "count": 2,
+        "columns": {"mac": [...], "ip": [...], "host": [0, 0]},
+        "dictionaries": {"host": ["192.168.1.1"]}
+    }
+"""
+
+# Device fields encoded as indexes into a dictionary of distinct values
+DEVICE_DICTIONARY_FIELDS = ("host", "dev")
+
+
+def columnar_devices(devices):
+    """
+    Return the columnar payload of a list of device records.
+    """
+    fields = []
+    for device in devices:
+        for field in device:
+            if field not in fields:
+                fields.append(field)
+
+    columns = {field: [] for field in fields}
+    dictionaries = {field: {} for field in fields if field in DEVICE_DICTIONARY_FIELDS}
+
+    for device in devices:
+        for field in fields:
+            value = device.get(field)
+            if field in dictionaries:
+                value = dictionaries[field].setdefault(value, len(dictionaries[field]))
+            columns[field].append(value)
+
+    return _payload(len(devices), columns, dictionaries)
+
+
+def columnar_communications(source_macs, destination_macs, dpids, extra_columns=None):
+    """
+    Return the columnar payload of communications given as columns of source and destination MACs.
+
+    The datapath of each communication is sent as index into a dictionary of the datapaths.
+    `extra_columns` maps further field names to columns sent as they are, e.g. counters.
+    """
+    sources = {}
+    destinations = {}
+    datapaths = {}
+    columns = {
+        "source_mac": [sources.setdefault(mac, len(sources)) for mac in source_macs],
+        "destination_mac": [
+            destinations.setdefault(mac, len(destinations)) for mac in destination_macs
+        ],
+        "dpid": [datapaths.setdefault(dpid, len(datapaths)) for dpid in dpids],
+    }
+    for field, column in (extra_columns or {}).items():
+        columns[field] = list(column)
+    dictionaries = {
+        "source_mac": sources,
+        "destination_mac": destinations,
+        "dpid": datapaths,
+    }
+
+    return _payload(len(columns["source_mac"]), columns, dictionaries)
+
+
+def _payload(count, columns, dictionaries):
+    return {
+        "format": "columnar",
+        "count": count,
+        "columns": columns,
+        "dictionaries": {field: list(values) for field, values in dictionaries.items()},
+    }
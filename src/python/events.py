@@ -0,0 +1,216 @@
+"""
+events.py - Server-Sent Events stream of topology changes.
+
+The changes found by the diff engine whenever a new snapshot is fetched are pushed to
+every connected client. Each client has a bounded queue, clients that don't keep up are
+disconnected and can resume with the ID of the last event they received.
+"""
+
+import asyncio
+import json
+import queue
+import threading
+from collections import deque
+
+import topology_diff
+
+DEVICE_JOINED = "device-joined"
+DEVICE_LEFT = "device-left"
+REACHABILITY_CHANGED = "reachability-changed"
+ISOLATION_CHANGED = "isolation-changed"
+COMMUNICATION_ADDED = "communication-added"
+IP_CHANGED = "ip-changed"
+HOSTNAME_CHANGED = "hostname-changed"
+JOB_FINISHED = "job-finished"
+
+# Event type of each type of change found by the diff engine
+CHANGE_EVENTS = {
+    topology_diff.DEVICE_APPEARED: DEVICE_JOINED,
+    topology_diff.DEVICE_DISAPPEARED: DEVICE_LEFT,
+    topology_diff.IP_CHANGED: IP_CHANGED,
+    topology_diff.HOSTNAME_CHANGED: HOSTNAME_CHANGED,
+    topology_diff.REACHABILITY_CHANGED: REACHABILITY_CHANGED,
+    topology_diff.COMMUNICATION_ADDED: COMMUNICATION_ADDED,
+    topology_diff.ISOLATION_ADDED: ISOLATION_CHANGED,
+    topology_diff.ISOLATION_REMOVED: ISOLATION_CHANGED,
+}
+
+# Sent when the requested events are no longer kept, the client has to reload the full state
+RESYNC = "resync"
+
+
+class _Subscriber:
+    """
+    A connected client and its queue of pending events.
+
+    Subscribers of the asyncio server have an asyncio queue, filled on their event loop.
+    """
+
+    def __init__(self, queue_size, loop=None):
+        self.loop = loop
+        if loop is None:
+            self.queue = queue.Queue(maxsize=queue_size)
+        else:
+            self.queue = asyncio.Queue(maxsize=queue_size)
+        self.evicted = False
+
+
+class EventBroker:
+    """
+    Distributes events to all subscribers and keeps the latest events for resuming.
+    """
+
+    def __init__(
+        self, queue_size=256, history_size=1000, heartbeat=15, on_subscribe=None
+    ):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.on_subscribe = on_subscribe
+
+        self._next_id = 1
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, event_type, data):
+        """
+        Send an event to all subscribers, evicting those whose queue is full.
+        """
+        with self._lock:
+            event = (self._next_id, event_type, data)
+            self._next_id += 1
+            self._history.append(event)
+
+            for subscriber in list(self._subscribers):
+                if subscriber.loop is not None:
+                    try:
+                        subscriber.loop.call_soon_threadsafe(
+                            self._deliver, subscriber, event
+                        )
+                    except RuntimeError:
+                        # The event loop of the subscriber was closed
+                        self._evict(subscriber)
+                    continue
+
+                try:
+                    subscriber.queue.put_nowait(event)
+                except queue.Full:
+                    self._evict(subscriber)
+
+    def stream(self, last_event_id=None):
+        """
+        Return a generator of SSE messages for a new subscriber.
+
+        Events after `last_event_id` are replayed first, if they are still kept.
+        """
+        return self._generate(*self._subscribe(last_event_id))
+
+    async def astream(self, last_event_id=None):
+        """
+        Asynchronous variant of stream() for the asyncio server.
+
+        Events are handed to the event loop of the subscriber, so waiting subscribers
+        don't occupy a thread.
+        """
+        subscriber, backlog = self._subscribe(
+            last_event_id, asyncio.get_running_loop()
+        )
+        try:
+            yield "retry: 3000\n\n"
+
+            for event in backlog:
+                yield format_event(*event)
+
+            while not subscriber.evicted:
+                try:
+                    event = await asyncio.wait_for(
+                        subscriber.queue.get(), self.heartbeat
+                    )
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_event(*event)
+        finally:
+            self._unsubscribe(subscriber)
+
+    def _deliver(self, subscriber, event):
+        # Runs on the event loop of an asyncio subscriber
+        if subscriber.evicted:
+            return
+        try:
+            subscriber.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            with self._lock:
+                self._evict(subscriber)
+
+    def _evict(self, subscriber):
+        # Called with the lock held
+        print("Evicting slow event subscriber.")
+        subscriber.evicted = True
+        self._subscribers.discard(subscriber)
+
+    def _subscribe(self, last_event_id, loop=None):
+        subscriber = _Subscriber(self.queue_size, loop)
+
+        # Register and take the backlog at once, so no event is lost or sent twice
+        with self._lock:
+            self._subscribers.add(subscriber)
+            backlog = []
+            if last_event_id is not None:
+                oldest = self._history[0][0] if self._history else self._next_id
+                # Unknown IDs were given by an earlier run of the server
+                if last_event_id < oldest - 1 or last_event_id >= self._next_id:
+                    backlog.append((None, RESYNC, {}))
+                else:
+                    backlog = [e for e in self._history if e[0] > last_event_id]
+
+        if self.on_subscribe is not None:
+            self.on_subscribe()
+        return subscriber, backlog
+
+    def _unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        """
+        Return the number of connected subscribers.
+        """
+        with self._lock:
+            return len(self._subscribers)
+
+    def _generate(self, subscriber, backlog):
+        try:
+            # Tell the browser how long to wait before reconnecting
+            yield "retry: 3000\n\n"
+
+            for event in backlog:
+                yield format_event(*event)
+
+            while not subscriber.evicted:
+                try:
+                    event = subscriber.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_event(*event)
+        finally:
+            self._unsubscribe(subscriber)
+
+
+def format_event(event_id, event_type, data):
+    """
+    Format an event as SSE message.
+    """
+    message = ""
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    message += f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+    return message
+
+
+def change_events(diff):
+    """
+    Return the events of the typed changes of a diff as (type, data) tuples.
+    """
+    return [(CHANGE_EVENTS[change.type], change.data) for change in diff.changes]
@@ -0,0 +1,148 @@
+"""
+flow_parser.py - Incremental parsing of large flow dumps of the Ryu controller.
+
+A /stats/flow response has the form {"<dpid>": [flow, flow, ...]}. Instead of loading
+the whole document, the flow array is walked entry by entry and every flow is reduced
+to the fields the server uses, so memory stays bounded by the size of a single flow.
+"""
+
+import codecs
+import json
+
+# Fields of a flow kept by the parser
+MATCH_FIELDS = ("in_port", "dl_src", "dl_dst")
+COUNTER_FIELDS = ("packet_count", "byte_count", "duration_sec")
+
+_WHITESPACE = " \t\n\r"
+
+
+def slim_flow(flow):
+    """
+    Reduce a flow to its input port, source and destination MAC, actions and counters.
+    """
+    match = flow.get("match") or {}
+    slim = {
+        "match": {key: match[key] for key in MATCH_FIELDS if key in match},
+        "actions": flow.get("actions", []),
+    }
+    for key in COUNTER_FIELDS:
+        if key in flow:
+            slim[key] = flow[key]
+    return slim
+
+
+def iter_flows(chunks, dpid):
+    """
+    Yield the slimmed flows of a datapath from the byte chunks of a /stats/flow response.
+
+    Flows listed under other datapaths are parsed and dropped. Raises ValueError if
+    the document is malformed or ends early.
+    """
+    dpid = str(dpid)
+    reader = _ChunkReader(chunks)
+
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+
+    while True:
+        key = reader.decode()
+        reader.expect(":")
+        reader.expect("[")
+
+        if reader.peek() == "]":
+            reader.expect("]")
+        else:
+            while True:
+                flow = reader.decode()
+                if key == dpid:
+                    yield slim_flow(flow)
+                if reader.separator("]") == "]":
+                    break
+
+        if reader.separator("}") == "}":
+            return
+
+
+class _ChunkReader:
+    """
+    Buffer over the decoded text of the chunks, consumed from the front.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def peek(self):
+        """
+        Return the next non-whitespace character without consuming it.
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of flow dump")
+
+    def next_token(self):
+        """
+        Consume and return the next non-whitespace character.
+        """
+        char = self.peek()
+        self._pos += 1
+        return char
+
+    def expect(self, char):
+        """
+        Consume the next non-whitespace character, which has to be `char`.
+        """
+        found = self.next_token()
+        if found != char:
+            raise ValueError(f"Expected '{char}' in flow dump, found '{found}'")
+
+    def separator(self, closing):
+        """
+        Consume the token after a value, which is either a comma or the `closing` bracket.
+        """
+        found = self.next_token()
+        if found not in (",", closing):
+            raise ValueError(f"Expected ',' or '{closing}' in flow dump, found '{found}'")
+        return found
+
+    def decode(self):
+        """
+        Decode the next complete JSON value, reading more chunks until it is complete.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # The value is cut off at the end of the buffer
+                if not self._fill():
+                    raise ValueError("Unexpected end of flow dump")
+                continue
+            self._pos = end
+            return value
+
+    def _fill(self):
+        # Drop the consumed text and append the next chunk
+        if self._eof:
+            return False
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text:
+                self._buffer += text
+                return True
+
+        self._eof = True
+        self._buffer += self._utf8.decode(b"", final=True)
+        return False
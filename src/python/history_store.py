@@ -0,0 +1,368 @@
+"""
+history_store.py - Persistent history of devices, communications and isolation in SQLite.
+
+Instead of a full copy of every snapshot, only the changes found by the diff engine are
+written: a row is added when a device, communication or isolation rule appears, changes
+or disappears. The state at any time is the latest row of every key up to that time.
+
+Snapshots are queued by the request and collector threads and written by a single
+background thread, which batches everything received within `batch_interval` seconds
+into one transaction. The database runs in WAL mode, so queries are not blocked by the
+writer. Rows older than the retention are compacted to the state at the cutoff.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from changelog import REMOVED
+from snapshots import canonical_mac
+from topology_diff import ISOLATION_ADDED, ISOLATION_REMOVED, device_key
+
+# table, key columns, value columns
+KINDS = {
+    "devices": ("device_history", ("mac", "ip"), ("hostname", "host", "reachable")),
+    "communications": (
+        "communication_history",
+        ("source_mac", "destination_mac", "dpid"),
+        (),
+    ),
+    "isolation": ("isolation_history", ("mac",), ()),
+}
+
+_STOP = object()
+
+
+class HistoryStore:
+    """
+    Change-only SQLite history, written by a background thread.
+    """
+
+    def __init__(
+        self,
+        path,
+        batch_interval=10,
+        retention=30 * 86400,
+        compact_interval=3600,
+        queue_size=100,
+    ):
+        self.path = path
+        self.batch_interval = batch_interval
+        self.retention = retention
+        self.compact_interval = compact_interval
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._state = {kind: None for kind in KINDS}
+        self._thread = None
+        self._lock = threading.Lock()
+        self._written = 0
+        self._dropped = 0
+        self._resync = set()
+        self._last_flush = None
+
+    def start(self):
+        """
+        Create the schema and start the writer thread.
+        """
+        connection = self._connect()
+        try:
+            self._create_schema(connection)
+            for kind in KINDS:
+                self._state[kind] = self._load_state(connection, kind, time.time())
+        finally:
+            connection.close()
+
+        self._thread = threading.Thread(
+            target=self._write_loop, name="history-writer", daemon=True
+        )
+        self._thread.start()
+
+    def close(self, timeout=5):
+        """
+        Write the queued snapshots and stop the writer thread.
+        """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def record_devices(self, timestamp, diff, devices):
+        """
+        Queue the changes of a device snapshot found by the diff engine.
+
+        `devices` are all devices of the snapshot, stored if there are no changes to
+        build on, e.g. for the first snapshot after a restart.
+        """
+        self._enqueue(
+            "devices",
+            timestamp,
+            diff,
+            lambda: {device_key(device): _device_values(device) for device in devices},
+            lambda: {
+                key: None if kind == REMOVED else _device_values(device)
+                for key, (kind, device) in diff.records.items()
+            },
+        )
+
+    def record_communications(self, timestamp, diff, communications):
+        """
+        Queue the changes of the communications of a flow snapshot.
+        """
+        self._enqueue(
+            "communications",
+            timestamp,
+            diff,
+            lambda: {_communication_key(c): () for c in communications},
+            lambda: {
+                _communication_key(communication): None if kind == REMOVED else ()
+                for kind, communication in diff.records.values()
+            },
+        )
+
+    def record_isolation(self, timestamp, diff, macs):
+        """
+        Queue the changes of the isolated MACs of a flow snapshot.
+        """
+        self._enqueue(
+            "isolation",
+            timestamp,
+            diff,
+            lambda: {(canonical_mac(mac),): () for mac in macs},
+            lambda: {
+                (change.mac,): () if change.type == ISOLATION_ADDED else None
+                for change in diff.changes
+                if change.type in (ISOLATION_ADDED, ISOLATION_REMOVED)
+            },
+        )
+
+    def state_at(self, kind, timestamp):
+        """
+        Return the records of a kind that were present at the given time.
+        """
+        connection = self._connect()
+        try:
+            state = self._load_state(connection, kind, timestamp)
+        finally:
+            connection.close()
+        return [self._record(kind, key, values) for key, values in state.items()]
+
+    def changes(self, kind, start, end):
+        """
+        Return the changes of a kind between two times, oldest first.
+        """
+        table, keys, values = KINDS[kind]
+        columns = ("time",) + keys + values + ("present",)
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                f"SELECT {', '.join(columns)} FROM {table} "
+                "WHERE time > ? AND time <= ? ORDER BY time",
+                (start, end),
+            ).fetchall()
+        finally:
+            connection.close()
+        return [dict(zip(columns, row), present=bool(row[-1])) for row in rows]
+
+    def stats(self):
+        """
+        Return the counters of the writer.
+        """
+        with self._lock:
+            return {
+                "path": self.path,
+                "rows_written": self._written,
+                "snapshots_dropped": self._dropped,
+                "queued": self._queue.qsize(),
+                "last_flush": self._last_flush,
+            }
+
+    def _enqueue(self, kind, timestamp, diff, state, changes):
+        # After a dropped snapshot, changes would miss what it changed
+        with self._lock:
+            full = diff.initial or kind in self._resync
+            self._resync.discard(kind)
+        if full:
+            item = (kind, timestamp, state(), None)
+        else:
+            item = (kind, timestamp, None, changes())
+
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Never block a request, the next snapshot is stored completely instead
+            with self._lock:
+                self._dropped += 1
+                self._resync.add(kind)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # Durable at checkpoints, without a sync on every commit of the SD card
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _create_schema(self, connection):
+        # Has to be set before the first table is created to take effect
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        for table, keys, values in KINDS.values():
+            columns = ", ".join(keys + values)
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                f"(time REAL NOT NULL, {columns}, present INTEGER NOT NULL)"
+            )
+            connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_time ON {table} (time)"
+            )
+            connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_key "
+                f"ON {table} ({', '.join(keys)}, time)"
+            )
+        connection.commit()
+
+    def _load_state(self, connection, kind, timestamp):
+        table, keys, values = KINDS[kind]
+        columns = ", ".join(keys + values)
+        # SQLite takes the bare columns from the row with the maximum time of each group
+        rows = connection.execute(
+            f"SELECT {columns}, present, MAX(time) FROM {table} "
+            f"WHERE time <= ? GROUP BY {', '.join(keys)}",
+            (timestamp,),
+        ).fetchall()
+        return {
+            tuple(row[: len(keys)]): tuple(row[len(keys) : len(keys) + len(values)])
+            for row in rows
+            if row[len(keys) + len(values)]
+        }
+
+    def _record(self, kind, key, values):
+        _, keys, value_columns = KINDS[kind]
+        return dict(zip(keys + value_columns, key + values))
+
+    def _write_loop(self):
+        connection = self._connect()
+        pending = []
+        deadline = None
+        next_compaction = time.monotonic() + self.compact_interval
+
+        while True:
+            # Wake up for the end of the batch or the next compaction
+            wake_up = next_compaction
+            if deadline is not None:
+                wake_up = min(deadline, next_compaction)
+            timeout = max(wake_up - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            stop = item is _STOP
+            if item is not None and not stop:
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.batch_interval
+
+            if pending and (stop or time.monotonic() >= deadline):
+                try:
+                    self._flush(connection, pending)
+                except sqlite3.Error as error:
+                    print(f"Failed to write the history: {error}")
+                pending = []
+                deadline = None
+
+            if time.monotonic() >= next_compaction:
+                try:
+                    self._compact(connection)
+                except sqlite3.Error as error:
+                    print(f"Failed to compact the history: {error}")
+                next_compaction = time.monotonic() + self.compact_interval
+
+            if stop:
+                connection.close()
+                return
+
+    def _flush(self, connection, pending):
+        rows = {kind: [] for kind in KINDS}
+        for kind, timestamp, state, changes in pending:
+            previous = self._state[kind]
+            if state is not None:
+                # A complete snapshot, compared with the last stored state
+                changes = {
+                    key: values
+                    for key, values in state.items()
+                    if previous.get(key) != values
+                }
+                changes.update(dict.fromkeys(previous.keys() - state.keys()))
+
+            width = len(KINDS[kind][2])
+            for key, values in changes.items():
+                if values is None:
+                    if key in previous:
+                        del previous[key]
+                        rows[kind].append((timestamp,) + key + (None,) * width + (0,))
+                elif previous.get(key) != values:
+                    previous[key] = values
+                    rows[kind].append((timestamp,) + key + values + (1,))
+
+        written = 0
+        with connection:
+            for kind, kind_rows in rows.items():
+                if not kind_rows:
+                    continue
+                table, keys, values = KINDS[kind]
+                placeholders = ", ".join("?" * (len(keys) + len(values) + 2))
+                connection.executemany(
+                    f"INSERT INTO {table} (time, {', '.join(keys + values)}, present) "
+                    f"VALUES ({placeholders})",
+                    kind_rows,
+                )
+                written += len(kind_rows)
+
+        with self._lock:
+            self._written += written
+            self._last_flush = time.time()
+
+    def _compact(self, connection):
+        # Older rows are dropped, except the latest row of keys present at the cutoff
+        cutoff = time.time() - self.retention
+        with connection:
+            for table, keys, _ in KINDS.values():
+                connection.execute(
+                    f"DELETE FROM {table} WHERE time < ? AND rowid NOT IN ("
+                    f"SELECT id FROM (SELECT rowid AS id, present, MAX(time) "
+                    f"FROM {table} WHERE time < ? GROUP BY {', '.join(keys)}) "
+                    "WHERE present = 1)",
+                    (cutoff, cutoff),
+                )
+        connection.execute("PRAGMA incremental_vacuum")
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def _device_values(device):
+    return (
+        device.get("hostname"),
+        device.get("host"),
+        1 if device.get("reachable") else 0,
+    )
+
+
+def _communication_key(communication):
+    return (
+        canonical_mac(communication["source_mac"]),
+        canonical_mac(communication["destination_mac"]),
+        str(communication["dpid"]),
+    )
+
+
+def parse_time(value, default=None):
+    """
+    Parse a time given as Unix timestamp or ISO 8601 string.
+
+    Raises ValueError for malformed values.
+    """
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
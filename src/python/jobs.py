@@ -0,0 +1,187 @@
+"""
+jobs.py - Background queue for flow mod operations.
+
+Isolating or including devices can be queued instead of holding the HTTP request until
+Ryu answers. A bounded pool of worker threads runs the queued jobs, clients poll the
+status of a job by its ID or wait for its event on the event stream.
+
+Jobs touching the same MAC address run in the order they were submitted, so a quick
+isolate followed by an include can't be reordered by the workers.
+"""
+
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from snapshots import canonical_mac
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """
+    Raised if a job is submitted while the queue is full.
+    """
+
+
+class Job:
+    """
+    A queued flow mod operation and its outcome.
+    """
+
+    def __init__(self, kind, macs, run):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.macs = list(macs)
+        self.run = run
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        # Earlier jobs on the same MACs, which have to finish first
+        self.depends_on = []
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "macs": self.macs,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    Bounded queue of jobs, run by `workers` threads.
+
+    The `run` function of a job returns a dict whose "status" is "success" or "error",
+    like the responses of the flow mod endpoints. `on_finish` is called with every
+    finished job. The latest `history_size` jobs can be looked up by their ID.
+    """
+
+    def __init__(self, workers=4, queue_size=100, history_size=1000, on_finish=None):
+        self.workers = workers
+        self.history_size = history_size
+        self.on_finish = on_finish
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._jobs = OrderedDict()
+        self._last_by_mac = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, kind, macs, run):
+        """
+        Queue a job and return it at once. Raises QueueFull if the queue is full.
+        """
+        self._start()
+        job = Job(kind, macs, run)
+
+        with self._lock:
+            keys = {canonical_mac(mac) for mac in job.macs}
+            job.depends_on = [
+                self._last_by_mac[key]
+                for key in keys
+                if key in self._last_by_mac and not self._last_by_mac[key].done.is_set()
+            ]
+
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFull()
+
+            for key in keys:
+                self._last_by_mac[key] = job
+            self._jobs[job.id] = job
+            self._evict()
+
+        return job
+
+    def get(self, job_id):
+        """
+        Return the status of a job, or None if it is unknown or was evicted.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job is not None else None
+
+    def stats(self):
+        """
+        Return the number of queued, running and kept jobs.
+        """
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            "workers": self.workers,
+            "queued": statuses.count(QUEUED),
+            "running": statuses.count(RUNNING),
+            "kept": len(statuses),
+        }
+
+    def _evict(self):
+        # Drop the oldest finished jobs, running ones are kept until they finish
+        while len(self._jobs) > self.history_size:
+            oldest = next(iter(self._jobs.values()))
+            if not oldest.done.is_set():
+                break
+            self._jobs.popitem(last=False)
+
+    def _start(self):
+        if self._threads:
+            return
+
+        with self._lock:
+            if not self._threads:
+                for index in range(self.workers):
+                    thread = threading.Thread(
+                        target=self._work, name=f"job-worker-{index}", daemon=True
+                    )
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+
+            # Earlier jobs were taken from the queue before, so they are running or done
+            for earlier in job.depends_on:
+                earlier.done.wait()
+
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                job.result = job.run()
+                job.status = SUCCEEDED if job.result.get("status") == "success" else FAILED
+            except Exception as error:
+                print(f"Job {job.id} failed: {error}")
+                job.error = str(error)
+                job.status = FAILED
+            job.finished_at = time.time()
+            job.depends_on = []
+
+            with self._lock:
+                for mac in job.macs:
+                    key = canonical_mac(mac)
+                    if self._last_by_mac.get(key) is job:
+                        del self._last_by_mac[key]
+            job.done.set()
+
+            if self.on_finish is not None:
+                try:
+                    self.on_finish(job)
+                except Exception as error:
+                    print(f"Failed to report job {job.id}: {error}")
@@ -0,0 +1,489 @@
+"""
+layout.py - Force-directed layout of the topology graph, computed on the server.
+
+The model follows the d3 force simulation used by the card: nodes repel each other,
+links pull connected nodes to a fixed distance, the graph is centered and nodes are
+drawn back into the drawing area. Clients only draw the resulting positions. Each
+layout starts from the previous one, so only changes move the graph.
+
+Repulsion is approximated on a uniform grid. Nodes in the same or a neighbouring cell
+repel each other exactly, cells further away act through their center of mass on all
+nodes of a cell at once. Each step is thereby linear in the number of nodes for
+evenly spread graphs, instead of quadratic.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+# Same defaults as the force simulation of the card
+ALPHA_MIN = 0.001
+VELOCITY_DECAY = 0.4
+LINK_DISTANCE = 30
+BOUNDARY_STRENGTH = 0.1
+
+# Distance of the outermost nodes to the border of the drawing area
+MARGIN = 15
+
+# Start of the cooling for incremental layouts, only the changed nodes are off balance
+INCREMENTAL_ALPHA = 0.3
+
+# Average distance in pixels the nodes have to move per step to keep simulating
+MIN_MOVEMENT = 0.1
+
+# Average number of nodes per grid cell
+NODES_PER_CELL = 4
+
+
+class LayoutEngine:
+    """
+    Computes node positions and caches them per topology.
+
+    A topology is given by its node keys and links, two topologies with the same nodes
+    and links get the same positions. The positions of the latest `cache_size`
+    topologies are kept.
+
+    Layouts are incremental: the nodes of the previous layout of the same `name` start
+    at their previous position, new nodes next to a node they are linked to. Only the
+    changed part of the graph is out of balance, so the simulation starts cooler and
+    usually stops after a few steps, once the nodes hardly move anymore. A new key
+    with the same identity as a key that disappeared, e.g. a device with a new IP
+    address, starts at the position of the old key.
+    """
+
+    def __init__(
+        self, width=500, height=500, charge=-300, iterations=120, cache_size=8
+    ):
+        self.width = width
+        self.height = height
+        self.charge = charge
+        self.iterations = iterations
+        self.cache_size = cache_size
+
+        # Unscaled positions, links, scaling and identities of the latest layouts by name
+        self._layouts = OrderedDict()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._computed = 0
+        self._hits = 0
+        self._last_steps = None
+
+    def positions(self, nodes, links, name="default", charge=None, identities=None):
+        """
+        Return {key: (x, y)} for the node keys and (key, key) links of a topology.
+
+        `charge` overrides the configured repulsion. `identities` optionally maps keys
+        to a stable identity, used to place keys that replaced another one.
+        """
+        charge = self.charge if charge is None else charge
+        identities = dict(identities or {})
+        nodes = sorted(set(nodes))
+        links = sorted({tuple(link) for link in links})
+        topology = (name, charge, tuple(nodes), tuple(links))
+
+        with self._lock:
+            entry = self._cache.get(topology)
+            if entry is not None:
+                self._cache.move_to_end(topology)
+                self._hits += 1
+                self._remember(name, entry[:3] + (identities,))
+                return entry[3]
+            previous = self._layouts.get(name, ({}, (), None, {}))
+
+        layout, steps = self._compute(nodes, links, charge, identities, previous)
+        xs, ys, transform = fit(
+            [x for x, _ in layout.values()],
+            [y for _, y in layout.values()],
+            self.width,
+            self.height,
+            previous[2],
+        )
+        positions = {
+            key: (round(x, 2), round(y, 2)) for key, x, y in zip(layout, xs, ys)
+        }
+
+        with self._lock:
+            self._remember(name, (layout, links, transform, identities))
+            self._cache[topology] = (layout, links, transform, positions)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self._computed += 1
+            self._last_steps = steps
+        return positions
+
+    def stats(self):
+        """
+        Return the number of layouts computed and answered from the cache.
+        """
+        with self._lock:
+            return {
+                "computed": self._computed,
+                "cache_hits": self._hits,
+                "cached": len(self._cache),
+                "last_steps": self._last_steps,
+            }
+
+    def _remember(self, name, layout):
+        # Must be called with the lock held
+        self._layouts[name] = layout
+        self._layouts.move_to_end(name)
+        while len(self._layouts) > self.cache_size:
+            self._layouts.popitem(last=False)
+
+    def _compute(self, nodes, links, charge, identities, previous):
+        previous, previous_links, _, previous_identities = previous
+        index = {key: i for i, key in enumerate(nodes)}
+        xs, ys = _initial_positions(len(nodes), self.width / 2, self.height / 2)
+        edges = [(index[a], index[b]) for a, b in links if a in index and b in index]
+
+        # Keys that disappeared, by identity, to place the keys that replaced them
+        replaced = {}
+        for key, identity in previous_identities.items():
+            if key in previous and key not in index:
+                replaced.setdefault(identity, []).append(key)
+
+        placed = [False] * len(nodes)
+        new = set()
+        for key, i in index.items():
+            if key in previous:
+                xs[i], ys[i] = previous[key]
+                placed[i] = True
+                continue
+            new.add(i)
+            old_keys = replaced.get(identities.get(key))
+            if old_keys:
+                xs[i], ys[i] = previous[old_keys.pop()]
+                placed[i] = True
+
+        alpha = 1.0
+        mobile = None
+        if any(placed):
+            # Only new nodes and the nodes whose links were added or removed move
+            mobile = set(new)
+            for link in set(links).symmetric_difference(previous_links):
+                mobile.update(index[key] for key in link if key in index)
+
+            _place_new_nodes(xs, ys, edges, placed)
+            alpha = INCREMENTAL_ALPHA
+
+        steps = simulate(
+            xs,
+            ys,
+            edges,
+            self.width,
+            self.height,
+            charge,
+            self.iterations,
+            alpha=alpha,
+            mobile=mobile,
+        )
+        return {key: (xs[i], ys[i]) for key, i in index.items()}, steps
+
+
+def simulate(
+    xs, ys, edges, width, height, charge, iterations, alpha=1.0, mobile=None
+):
+    """
+    Move the nodes at (xs, ys) in place for up to `iterations` steps of the force model.
+
+    `edges` are pairs of node indexes. Like in d3, `alpha` cools down to ALPHA_MIN
+    over the given number of steps. If `mobile` is a set of node indexes, only these
+    nodes move, the others stay in place but still act on them. The simulation stops
+    early once the moving nodes moved less than MIN_MOVEMENT on average in a step.
+    Returns the number of steps taken.
+    """
+    count = len(xs)
+    active = range(count) if mobile is None else sorted(mobile)
+    if not active:
+        return 0
+    vxs = [0.0] * count
+    vys = [0.0] * count
+    links = [
+        link
+        for link in _link_parameters(count, edges)
+        if mobile is None or link[0] in mobile or link[1] in mobile
+    ]
+    decay = 1 - ALPHA_MIN ** (1 / max(iterations, 1))
+
+    for step in range(1, iterations + 1):
+        alpha -= alpha * decay
+        _apply_charge(xs, ys, vxs, vys, charge * alpha, mobile)
+        if mobile is None:
+            # Incremental layouts are held in place by the nodes that don't move
+            _apply_center(xs, ys, width / 2, height / 2)
+        _apply_links(xs, ys, vxs, vys, links, alpha, mobile)
+        _apply_boundary(xs, ys, vxs, vys, width, height, alpha, active)
+
+        movement = 0.0
+        for i in active:
+            vxs[i] *= 1 - VELOCITY_DECAY
+            vys[i] *= 1 - VELOCITY_DECAY
+            xs[i] += vxs[i]
+            ys[i] += vys[i]
+            movement += abs(vxs[i]) + abs(vys[i])
+
+        if movement < MIN_MOVEMENT * len(active):
+            return step
+    return iterations
+
+
+def fit(xs, ys, width, height, transform=None, margin=MARGIN):
+    """
+    Return the positions scaled down into the drawing area if the graph is larger.
+
+    Also returns the (scale, x offset, y offset) applied. A given transform is kept as
+    long as all nodes stay inside the drawing area with it, so nodes that didn't move
+    in the layout don't move in the drawing either.
+    """
+    if not xs:
+        return xs, ys, transform
+
+    if transform is not None:
+        fitted_xs, fitted_ys = _transform(xs, ys, transform)
+        if _inside(fitted_xs, fitted_ys, width, height):
+            return fitted_xs, fitted_ys, transform
+
+    min_x, max_x = min(xs), max(xs)
+    min_y, max_y = min(ys), max(ys)
+    scale = min(
+        (width - 2 * margin) / max(max_x - min_x, 1e-9),
+        (height - 2 * margin) / max(max_y - min_y, 1e-9),
+        1,
+    )
+    if scale == 1 and _inside(xs, ys, width, height):
+        transform = (1, 0, 0)
+    else:
+        # Centered in the drawing area, keeping the proportions
+        transform = (
+            scale,
+            width / 2 - (min_x + max_x) / 2 * scale,
+            height / 2 - (min_y + max_y) / 2 * scale,
+        )
+    return _transform(xs, ys, transform) + (transform,)
+
+
+def _transform(xs, ys, transform):
+    scale, offset_x, offset_y = transform
+    return (
+        [x * scale + offset_x for x in xs],
+        [y * scale + offset_y for y in ys],
+    )
+
+
+def _inside(xs, ys, width, height):
+    return min(xs) >= 0 and min(ys) >= 0 and max(xs) <= width and max(ys) <= height
+
+
+def _initial_positions(count, cx, cy):
+    # Phyllotaxis arrangement as used by d3, spreading nodes evenly without randomness
+    xs = []
+    ys = []
+    angle = math.pi * (3 - math.sqrt(5))
+    for i in range(count):
+        radius = 10 * math.sqrt(0.5 + i)
+        xs.append(cx + radius * math.cos(i * angle))
+        ys.append(cy + radius * math.sin(i * angle))
+    return xs, ys
+
+
+def _place_new_nodes(xs, ys, edges, placed):
+    # Next to a placed node they are linked to, nodes without one keep their start
+    neighbours = {}
+    for source, target in edges:
+        neighbours.setdefault(source, []).append(target)
+        neighbours.setdefault(target, []).append(source)
+
+    angle = math.pi * (3 - math.sqrt(5))
+    pending = [i for i, done in enumerate(placed) if not done]
+    while pending:
+        waiting = []
+        for i in pending:
+            anchor = next((j for j in neighbours.get(i, ()) if placed[j]), None)
+            if anchor is None:
+                waiting.append(i)
+                continue
+            xs[i] = xs[anchor] + LINK_DISTANCE * math.cos(i * angle)
+            ys[i] = ys[anchor] + LINK_DISTANCE * math.sin(i * angle)
+            placed[i] = True
+        if len(waiting) == len(pending):
+            return
+        pending = waiting
+
+
+def _link_parameters(count, edges):
+    # Links of nodes with many links are weaker, the node with fewer links moves more
+    degree = [0] * count
+    for source, target in edges:
+        degree[source] += 1
+        degree[target] += 1
+
+    links = []
+    for source, target in edges:
+        if source == target:
+            continue
+        strength = 1 / min(degree[source], degree[target])
+        bias = degree[source] / (degree[source] + degree[target])
+        links.append((source, target, strength, bias))
+    return links
+
+
+def _apply_links(xs, ys, vxs, vys, links, alpha, mobile):
+    # Nodes that don't move keep a velocity of 0
+    for source, target, strength, bias in links:
+        dx = xs[target] + vxs[target] - xs[source] - vxs[source]
+        dy = ys[target] + vys[target] - ys[source] - vys[source]
+        distance = math.sqrt(dx * dx + dy * dy) or 1e-6
+        factor = (distance - LINK_DISTANCE) / distance * alpha * strength
+        dx *= factor
+        dy *= factor
+        if mobile is None or target in mobile:
+            vxs[target] -= dx * bias
+            vys[target] -= dy * bias
+        if mobile is None or source in mobile:
+            vxs[source] += dx * (1 - bias)
+            vys[source] += dy * (1 - bias)
+
+
+def _apply_center(xs, ys, cx, cy):
+    count = len(xs)
+    shift_x = sum(xs) / count - cx
+    shift_y = sum(ys) / count - cy
+    for i in range(count):
+        xs[i] -= shift_x
+        ys[i] -= shift_y
+
+
+def _apply_boundary(xs, ys, vxs, vys, width, height, alpha, active):
+    # Nodes outside the drawing area are pulled back to its border
+    strength = BOUNDARY_STRENGTH * alpha
+    for i in active:
+        vxs[i] += (min(max(xs[i], 0), width) - xs[i]) * strength
+        vys[i] += (min(max(ys[i], 0), height) - ys[i]) * strength
+
+
+def _apply_charge(xs, ys, vxs, vys, strength, mobile):
+    count = len(xs)
+    depth = max(1, math.ceil(math.log(max(count / NODES_PER_CELL, 1), 4)))
+    side = 1 << depth
+    min_x = min(xs)
+    min_y = min(ys)
+    cell_width = (max(xs) - min_x) / side + 1e-9
+    cell_height = (max(ys) - min_y) / side + 1e-9
+
+    cells = {}
+    for i in range(count):
+        cell = (int((xs[i] - min_x) / cell_width), int((ys[i] - min_y) / cell_height))
+        cells.setdefault(cell, []).append(i)
+
+    # Sums of x, y and the number of nodes of every cell, from the finest level up
+    levels = [None] * (depth + 1)
+    levels[depth] = {
+        cell: [sum(xs[i] for i in members), sum(ys[i] for i in members), len(members)]
+        for cell, members in cells.items()
+    }
+    for level in range(depth, 1, -1):
+        coarse = {}
+        for (col, row), (sum_x, sum_y, weight) in levels[level].items():
+            total = coarse.setdefault((col >> 1, row >> 1), [0.0, 0.0, 0])
+            total[0] += sum_x
+            total[1] += sum_y
+            total[2] += weight
+        levels[level - 1] = coarse
+
+    for (col, row), members in cells.items():
+        if mobile is not None:
+            members = [i for i in members if i in mobile]
+            if not members:
+                continue
+        sum_x, sum_y, weight = levels[depth][(col, row)]
+        own_x = sum_x / weight
+        own_y = sum_y / weight
+
+        # Distant cells act through their center of mass, coarser ones the further away
+        far_x = 0.0
+        far_y = 0.0
+        for level in range(depth, 1, -1):
+            shift = depth - level
+            centers = levels[level]
+            for other in _interaction_list(col >> shift, row >> shift):
+                center = centers.get(other)
+                if center is None:
+                    continue
+                dx = center[0] / center[2] - own_x
+                dy = center[1] / center[2] - own_y
+                factor = strength * center[2] / max(dx * dx + dy * dy, 1)
+                far_x += dx * factor
+                far_y += dy * factor
+
+        for i in members:
+            vxs[i] += far_x
+            vys[i] += far_y
+
+        if mobile is not None:
+            _repel_near(xs, ys, vxs, vys, strength, cells, col, row, members)
+            continue
+
+        # Pairs in this and the neighbouring cells exactly, each pair once
+        for offset_col, offset_row in _FORWARD_NEIGHBOURS:
+            others = cells.get((col + offset_col, row + offset_row))
+            if others is None:
+                continue
+            same = offset_col == 0 and offset_row == 0
+            for position, i in enumerate(members):
+                x = xs[i]
+                y = ys[i]
+                for j in members[position + 1 :] if same else others:
+                    dx = xs[j] - x
+                    dy = ys[j] - y
+                    distance = dx * dx + dy * dy
+                    if distance < 1:
+                        # Coincident nodes are pushed apart in a fixed direction
+                        dx = dx or 1e-3
+                        distance = 1
+                    factor = strength / distance
+                    dx *= factor
+                    dy *= factor
+                    vxs[i] += dx
+                    vys[i] += dy
+                    vxs[j] -= dx
+                    vys[j] -= dy
+
+
+def _repel_near(xs, ys, vxs, vys, strength, cells, col, row, members):
+    # Every node of the neighbouring cells acts on the given ones, only these move
+    for offset_col in (-1, 0, 1):
+        for offset_row in (-1, 0, 1):
+            others = cells.get((col + offset_col, row + offset_row))
+            if others is None:
+                continue
+            for i in members:
+                x = xs[i]
+                y = ys[i]
+                for j in others:
+                    if j == i:
+                        continue
+                    dx = xs[j] - x
+                    dy = ys[j] - y
+                    distance = dx * dx + dy * dy
+                    if distance < 1:
+                        dx = dx or 1e-3 * (1 if j > i else -1)
+                        distance = 1
+                    factor = strength / distance
+                    vxs[i] += dx * factor
+                    vys[i] += dy * factor
+
+
+def _interaction_list(col, row):
+    # Children of the neighbours of the parent cell, except the neighbours of the cell
+    first_col = (col & ~1) - 2
+    first_row = (row & ~1) - 2
+    return [
+        (other_col, other_row)
+        for other_col in range(first_col, first_col + 6)
+        for other_row in range(first_row, first_row + 6)
+        if abs(other_col - col) > 1 or abs(other_row - row) > 1
+    ]
+
+
+# The cell itself and the neighbours after it, so every pair of cells is visited once
+_FORWARD_NEIGHBOURS = ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
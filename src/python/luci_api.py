@@ -0,0 +1,79 @@
+"""
+luci_api.py - Long-lived access to the LuCI RPC API of the OpenWRT router.
+
+Logging in to LuCI is the most expensive call on the router, so the session is kept
+between requests and only renewed when it expires or is rejected.
+"""
+
+import threading
+import time
+
+from openwrt_luci_rpc import OpenWrtRpc
+from openwrt_luci_rpc.exceptions import InvalidLuciLoginError, InvalidLuciTokenError
+
+
+class LuciSession:
+    """
+    Authenticated LuCI client shared by all request handlers.
+
+    The client and its session token are reused until `session_ttl` seconds have passed
+    or the router rejects the token. Access is serialized, so concurrent requests wait
+    for one login instead of logging in themselves.
+    """
+
+    def __init__(self, host, user, password, session_ttl=3000):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.session_ttl = session_ttl
+
+        self._router = None
+        self._logged_in_at = 0.0
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._logins = 0
+
+    def get_all_connected_devices(self, only_reachable=False):
+        """
+        Return the connected devices of the router, logging in only if required.
+        """
+        with self._lock:
+            self._calls += 1
+            router = self._get_router()
+            try:
+                return router.get_all_connected_devices(only_reachable=only_reachable)
+            except (InvalidLuciLoginError, InvalidLuciTokenError) as error:
+                # Other errors are not caused by the session, a new login would not help
+                print(f"LuCI session rejected, logging in again: {str(error)}")
+                self._router = None
+                router = self._get_router()
+                return router.get_all_connected_devices(only_reachable=only_reachable)
+
+    def invalidate(self):
+        """
+        Drop the current session, the next call logs in again.
+        """
+        with self._lock:
+            self._router = None
+
+    def stats(self):
+        """
+        Return call and login counters of the session.
+        """
+        with self._lock:
+            age = time.monotonic() - self._logged_in_at if self._router else None
+            return {
+                "calls": self._calls,
+                "logins": self._logins,
+                "session_age": age,
+                "session_ttl": self.session_ttl,
+            }
+
+    def _get_router(self):
+        # Must be called with the lock held
+        expired = time.monotonic() - self._logged_in_at >= self.session_ttl
+        if self._router is None or expired:
+            self._router = OpenWrtRpc(self.host, self.user, self.password)
+            self._logged_in_at = time.monotonic()
+            self._logins += 1
+        return self._router
@@ -0,0 +1,160 @@
+"""
+reconciler.py - Declarative isolation of devices.
+
+Clients set the complete list of devices that should be isolated. The reconciler
+compares it with the isolation rules installed on each datapath and only sends the
+flow mods needed to get from one to the other. The comparison is repeated on a
+schedule, so rules lost by a switch restart are installed again.
+"""
+
+import threading
+import time
+from concurrent.futures import wait
+
+from snapshots import canonical_mac
+
+
+class IsolationReconciler:
+    """
+    Keeps the isolation rules of all datapaths equal to a desired set of MACs.
+
+    `fetch_installed` returns a dict of DPID to the isolated MACs installed on it.
+    `apply(command, mac, dpid)` sends an "add" or "delete_strict" flow mod and is run
+    on `executor`. `on_change` is called after flow mods were sent.
+    """
+
+    def __init__(self, fetch_installed, apply, executor, interval=60, on_change=None):
+        self.fetch_installed = fetch_installed
+        self.apply = apply
+        self.executor = executor
+        self.interval = interval
+        self.on_change = on_change
+
+        # None until a client sets the desired state, rules are not managed before
+        self._desired = None
+        self._last_result = None
+        self._last_run = None
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._thread = None
+
+    def set_desired(self, macs):
+        """
+        Replace the desired set of isolated MACs and converge to it at once.
+        """
+        with self._lock:
+            self._desired = {canonical_mac(mac) for mac in macs}
+        self._start()
+        return self.reconcile()
+
+    def isolate(self, macs):
+        """
+        Add MACs isolated by an imperative call, so the next run does not undo it.
+
+        Has to be called before the flow mods are sent. Waits for a running
+        reconciliation, which may have read the desired set before the change.
+        """
+        with self._run_lock, self._lock:
+            if self._desired is not None:
+                self._desired.update(canonical_mac(mac) for mac in macs)
+
+    def include(self, macs):
+        """
+        Remove MACs included by an imperative call from the desired set.
+
+        Has to be called before the flow mods are sent, like isolate().
+        """
+        with self._run_lock, self._lock:
+            if self._desired is not None:
+                self._desired.difference_update(canonical_mac(mac) for mac in macs)
+
+    def reconcile(self):
+        """
+        Diff the desired MACs against the installed rules and send the missing flow mods.
+
+        Returns the MACs added and removed per datapath and the errors that occurred.
+        """
+        with self._run_lock:
+            with self._lock:
+                desired = None if self._desired is None else set(self._desired)
+            if desired is None:
+                return None
+
+            result = {"added": {}, "removed": {}, "errors": {}}
+            try:
+                installed = self.fetch_installed()
+            except Exception as error:
+                print(f"Failed to fetch the installed isolation rules: {error}")
+                result["errors"]["installed"] = str(error) or type(error).__name__
+                return self._finish(result)
+
+            futures = {}
+            for dpid, macs in installed.items():
+                if isinstance(macs, Exception):
+                    result["errors"][str(dpid)] = str(macs)
+                    continue
+
+                # Installed MACs are removed as Ryu reported them, so strict deletes match
+                present = {canonical_mac(mac): mac for mac in macs}
+                for mac in sorted(desired - present.keys()):
+                    futures[("added", dpid, mac)] = self.executor.submit(
+                        self.apply, "add", mac, dpid
+                    )
+                for mac in sorted(present.keys() - desired):
+                    futures[("removed", dpid, mac)] = self.executor.submit(
+                        self.apply, "delete_strict", present[mac], dpid
+                    )
+
+            wait(futures.values())
+            for (kind, dpid, mac), future in futures.items():
+                try:
+                    future.result()
+                except Exception as error:
+                    print(f"Failed to reconcile the isolation of {mac} on {dpid}: {error}")
+                    result["errors"][f"{dpid}/{mac}"] = str(error)
+                    continue
+                result[kind].setdefault(str(dpid), []).append(canonical_mac(mac))
+
+            if futures and self.on_change is not None:
+                self.on_change()
+
+            return self._finish(result)
+
+    def status(self):
+        """
+        Return the desired MACs and the result of the last run.
+        """
+        with self._lock:
+            return {
+                "desired": None if self._desired is None else sorted(self._desired),
+                "interval": self.interval,
+                "last_run": self._last_run,
+                "last_result": self._last_result,
+            }
+
+    def _finish(self, result):
+        result["converged"] = not result["errors"]
+        with self._lock:
+            self._last_result = result
+            self._last_run = time.time()
+        return result
+
+    def _start(self):
+        if self._thread is not None or not self.interval:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name="isolation-reconciler", daemon=True
+                )
+                self._thread.start()
+
+    def _loop(self):
+        # Converge again regularly, e.g. after a switch lost its flow table
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.reconcile()
+            except Exception as error:
+                print(f"Isolation reconciliation failed: {error}")
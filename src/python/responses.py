@@ -0,0 +1,160 @@
+"""
+responses.py - Serialization of snapshot-backed responses.
+
+A response is serialized once per snapshot and cached together with a content hash,
+which is sent as ETag. Conditional requests for an unchanged snapshot are answered
+with 304 Not Modified without serializing or sending the body again. Clients knowing
+a previous version can ask for the changes since then instead of the full list.
+
+Large bodies are compressed with gzip, or brotli if it is installed, depending on the
+Accept-Encoding of the client. Compressed bodies are cached next to the serialized body,
+so each snapshot is compressed once per encoding and not once per client.
+
+The rendering itself does not depend on Flask, so the asyncio server uses it as well.
+"""
+
+import gzip
+import hashlib
+import json
+
+from flask import Response, current_app, request
+from werkzeug.http import parse_accept_header, parse_etags
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies below this size in bytes are sent uncompressed, unless configured otherwise
+DEFAULT_COMPRESSION_MIN_SIZE = 1024
+
+
+class EncodedBody:
+    """
+    Serialized JSON body of a response and its content hash.
+    """
+
+    def __init__(self, payload):
+        # Same output as jsonify, but usable outside of a Flask request
+        self.body = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode(
+            "utf-8"
+        )
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self._compressed = {}
+
+    def compressed(self, encoding):
+        """
+        Return the body compressed with the given encoding, compressing it only once.
+        """
+        body = self._compressed.get(encoding)
+        if body is None:
+            if encoding == "br":
+                body = brotli.compress(self.body)
+            else:
+                body = gzip.compress(self.body, compresslevel=6, mtime=0)
+            self._compressed[encoding] = body
+        return body
+
+    def is_compressed(self, encoding):
+        """
+        Return whether the body was already compressed with the given encoding.
+        """
+        return encoding in self._compressed
+
+
+def negotiate_encoding(size, accept_encoding, min_size=DEFAULT_COMPRESSION_MIN_SIZE):
+    """
+    Return the content encoding for a body of the given size, or None to send it uncompressed.
+    """
+    if size < min_size:
+        return None
+
+    offers = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return parse_accept_header(accept_encoding).best_match(offers)
+
+
+def render(snapshot, key, build, if_none_match=None, accept_encoding=None, min_size=None):
+    """
+    Render the response for a payload derived from a snapshot.
+
+    `build` returns the payload and is only called if the snapshot was not serialized
+    under `key` before. Returns the status, the headers and the body.
+    """
+    encoded = snapshot.memo(("json", key), lambda: EncodedBody(build()))
+    encoding = negotiate_encoding(
+        len(encoded.body),
+        accept_encoding,
+        DEFAULT_COMPRESSION_MIN_SIZE if min_size is None else min_size,
+    )
+
+    # Every encoding is a different representation and gets its own ETag
+    etag = f"{encoded.etag}-{encoding}" if encoding else encoded.etag
+
+    # Let the browser revalidate on every poll instead of guessing a freshness
+    headers = {
+        "ETag": f'"{etag}"',
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+        "X-Snapshot-Age": f"{snapshot.age():.1f}",
+        "X-Snapshot-Version": str(snapshot.version),
+    }
+
+    if parse_etags(if_none_match).contains_weak(etag):
+        return 304, headers, b""
+
+    headers["Content-Type"] = "application/json"
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        return 200, headers, encoded.compressed(encoding)
+    return 200, headers, encoded.body
+
+
+def is_rendered(snapshot, key, accept_encoding=None, min_size=None):
+    """
+    Return whether render() would find its body already serialized and compressed.
+
+    Lets the asyncio server render cheap responses directly and others in a thread.
+    """
+    encoded = snapshot.memoized(("json", key))
+    if encoded is None:
+        return False
+    encoding = negotiate_encoding(
+        len(encoded.body),
+        accept_encoding,
+        DEFAULT_COMPRESSION_MIN_SIZE if min_size is None else min_size,
+    )
+    return encoding is None or encoded.is_compressed(encoding)
+
+
+def delta(snapshot, log, since, build):
+    """
+    Return a builder for the changes of a record list between version `since` and the snapshot.
+
+    Falls back to the full list returned by `build` if the change log no longer
+    covers `since`.
+    """
+
+    def build_delta():
+        changes = log.changes(since, snapshot.version)
+        if changes is None:
+            return {"version": snapshot.version, "full": True, "items": build()}
+        return {"version": snapshot.version, "full": False, **changes}
+
+    return build_delta
+
+
+def snapshot_response(snapshot, key, build):
+    """
+    Return the Flask response for a payload derived from a snapshot.
+    """
+    status, headers, body = render(
+        snapshot,
+        key,
+        build,
+        if_none_match=request.headers.get("If-None-Match"),
+        accept_encoding=request.headers.get("Accept-Encoding"),
+        min_size=current_app.config.get(
+            "COMPRESSION_MIN_SIZE", DEFAULT_COMPRESSION_MIN_SIZE
+        ),
+    )
+    return Response(body, status=status, headers=headers)
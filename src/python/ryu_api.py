@@ -0,0 +1,195 @@
+"""
+ryu_api.py - Helpers for talking to the REST API (ofctl_rest) of the Ryu controller.
+
+This module provides:
+- A pooled keep-alive HTTP client for all calls to Ryu
+- A registry caching the datapath IDs of the switches known to Ryu
+"""
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class DatapathNotFound(Exception):
+    """
+    Raised when no datapath is known to the Ryu controller.
+    """
+
+
+class RyuClient:
+    """
+    Shared HTTP client for the Ryu REST API.
+
+    All calls go through one requests session with a bounded keep-alive pool, so
+    consecutive requests reuse their TCP connections instead of reconnecting.
+    Every call has explicit connect and read timeouts. The client can be shared
+    between the request threads of the server.
+    """
+
+    def __init__(self, base_url, pool_size=10, connect_timeout=3, read_timeout=10):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+
+        # Block instead of opening extra connections when the pool is exhausted
+        self._adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    def get(self, path, **kwargs):
+        """
+        Send a GET request to the given path of the Ryu REST API.
+        """
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        """
+        Send a POST request to the given path of the Ryu REST API.
+        """
+        return self.request("POST", path, **kwargs)
+
+    def request(self, method, path, **kwargs):
+        """
+        Send a request over the pooled session, using the default timeouts if none are given.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        with self._lock:
+            self._requests += 1
+        try:
+            return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def stats(self):
+        """
+        Return request counters and connection reuse of the keep-alive pool.
+        """
+        pools = []
+        manager = self._adapter.poolmanager
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append(
+                {
+                    "host": f"{pool.host}:{pool.port}",
+                    "max_size": pool.pool.maxsize if pool.pool else 0,
+                    "requests": pool.num_requests,
+                    "connections_opened": pool.num_connections,
+                    "connections_reused": max(
+                        pool.num_requests - pool.num_connections, 0
+                    ),
+                }
+            )
+
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "errors": self._errors,
+                "timeout": {"connect": self.timeout[0], "read": self.timeout[1]},
+                "pools": pools,
+            }
+
+
+class DpidRegistry:
+    """
+    Cache of the datapath IDs reported by the Ryu controller.
+
+    The switch list is kept for `ttl` seconds and refreshed by a background thread
+    before it expires, so request handlers can resolve the DPID without an extra
+    round trip to /stats/switches.
+    """
+
+    def __init__(self, ryu, ttl=60):
+        self.ryu = ryu
+        self.ttl = ttl
+
+        self._switches = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+
+    def switches(self):
+        """
+        Return the cached switch list, fetching it if it is missing or expired.
+        """
+        self._start_refresher()
+
+        with self._lock:
+            if self._switches is not None and not self._expired():
+                return self._switches
+
+        return self.refresh()
+
+    def refresh(self):
+        """
+        Fetch the switch list from /stats/switches and update the cache.
+
+        Concurrent callers wait for the running fetch instead of starting their own.
+        On errors the previous list is kept, so a short Ryu hiccup does not take all
+        endpoints down.
+        """
+        fetched_at = self._fetched_at
+        with self._refresh_lock:
+            # Another thread refreshed the cache while we were waiting
+            with self._lock:
+                if self._fetched_at != fetched_at and self._switches is not None:
+                    return self._switches
+
+            try:
+                response = self.ryu.get("/stats/switches")
+                response.raise_for_status()
+                switches = response.json()
+            except (requests.RequestException, ValueError) as error:
+                print(f"Error while retrieving DPID: {str(error)}")
+                with self._lock:
+                    return self._switches
+
+            if not switches:
+                print("No switches found.")
+
+            with self._lock:
+                self._switches = switches
+                self._fetched_at = time.monotonic()
+                return self._switches
+
+    def invalidate(self):
+        """
+        Drop the cached switch list, e.g. after Ryu reported an unknown datapath.
+        """
+        with self._lock:
+            self._switches = None
+            self._fetched_at = 0.0
+
+    def _expired(self):
+        return time.monotonic() - self._fetched_at >= self.ttl
+
+    def _start_refresher(self):
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._refresh_loop, name="dpid-registry", daemon=True
+                )
+                self._thread.start()
+
+    def _refresh_loop(self):
+        # Refresh at half the TTL, so the cached entry never expires while Ryu is up
+        while True:
+            time.sleep(self.ttl / 2)
+            self.refresh()
@@ -10,25 +10,73 @@ This script allows for interactions such as:
 Author: Jan Pfeifer
 """
 
-from flask import Flask, jsonify
-from flask_cors import CORS
-from openwrt_luci_rpc import OpenWrtRpc
-import requests
+import atexit
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
 import yaml
+from flask import Flask, Response, jsonify, request
+from flask_cors import CORS
+
+from changelog import ChangeLog
+from collector import Collector
+from columnar import columnar_communications, columnar_devices
+from events import JOB_FINISHED, EventBroker, change_events
+from flow_parser import iter_flows
+from history_store import KINDS, HistoryStore, parse_time
+from jobs import JobQueue, QueueFull
+from layout import LayoutEngine
+from luci_api import LuciSession
+from reconciler import IsolationReconciler
+from responses import delta, snapshot_response
+from ryu_api import DatapathNotFound, DpidRegistry, RyuClient
+from snapshots import (
+    DeviceSnapshot,
+    FlowSnapshot,
+    IsolationSnapshot,
+    NetworkFlowSnapshot,
+    SnapshotCache,
+    TopologySnapshot,
+    canonical_mac,
+)
+from timeseries import TimeSeriesStore, parse_window
+from topology_diff import DiffEngine, devices_by_mac
+from traffic import (
+    BYTE_RATE,
+    PACKET_RATE,
+    TRAFFIC_FIELDS,
+    compute_rates,
+    device_rates,
+    peer_traffic,
+    snapshot_traffic,
+)
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["ETag", "X-Snapshot-Age", "X-Snapshot-Version"])
 
 # Load the secrets.yaml file
 with open("../../../../config/secrets.yaml", "r") as file:
     secrets = yaml.safe_load(file)
 
+# Responses above this size are compressed if the client accepts it
+app.config["COMPRESSION_MIN_SIZE"] = secrets.get("compression_min_size", 1024)
+
 # Use the secrets in your Python code
 ROUTER_IP = secrets["router_ip"]
 ROUTER_USER = secrets["router_user"]
 ROUTER_PASSWORD = secrets["router_password"]
 
+# The LuCI login is reused between requests
+luci = LuciSession(
+    ROUTER_IP,
+    ROUTER_USER,
+    ROUTER_PASSWORD,
+    session_ttl=secrets.get("luci_session_ttl", 3000),
+)
+
 # OVS switch details
 RYU_ADDRESS = secrets["ryu_address"]
 RYU_PORT = secrets["ryu_port"]
@@ -37,19 +85,189 @@ RYU_PORT = secrets["ryu_port"]
 SWITCH_ADDRESS = secrets["switch_address"]
 SWITCH_PORT = secrets["switch_port"]
 
+# Shared keep-alive client for all calls to the Ryu REST API
+ryu = RyuClient(
+    f"http://{RYU_ADDRESS}:{RYU_PORT}",
+    pool_size=secrets.get("ryu_pool_size", 10),
+    connect_timeout=secrets.get("ryu_connect_timeout", 3),
+    read_timeout=secrets.get("ryu_read_timeout", 10),
+)
+
+# Runs upstream calls that a request makes concurrently, e.g. LuCI and Ryu for /topology
+upstream_pool = ThreadPoolExecutor(
+    max_workers=secrets.get("upstream_workers", 8), thread_name_prefix="upstream"
+)
+
+# The last /topology snapshot, reused while its device and flow snapshots are current
+last_topology = None
+last_topology_lock = threading.Lock()
+
+# Isolation rules are installed with this cookie and priority, so they can be queried separately
+ISOLATION_COOKIE = 1
+ISOLATION_PRIORITY = 1000
+ISOLATION_FILTER = {
+    "table_id": 0,
+    "cookie": ISOLATION_COOKIE,
+    "cookie_mask": ISOLATION_COOKIE,
+    "priority": ISOLATION_PRIORITY,
+}
+
+# Datapath IDs are cached, so the handlers don't query /stats/switches on every request
+dpid_registry = DpidRegistry(ryu, ttl=secrets.get("dpid_ttl", 60))
+
+# Flow dumps and flow mods of several datapaths run in parallel, at most this many at once
+datapath_pool = ThreadPoolExecutor(
+    max_workers=secrets.get("datapath_workers", 4), thread_name_prefix="datapath"
+)
+
+# Flow mods are sent concurrently, bounded by the connection pool to Ryu
+flow_mod_pool = ThreadPoolExecutor(
+    max_workers=secrets.get("ryu_pool_size", 10), thread_name_prefix="flow-mod"
+)
+
+# The last flow snapshot of every datapath, served while a later dump fails
+datapath_snapshots = {}
+datapath_snapshots_lock = threading.Lock()
+
+# The device list is shared by /devices and /topology, so unchanged snapshots keep their
+# serialized body and ETag instead of being fetched and serialized for every request
+device_cache = SnapshotCache(
+    lambda: fetch_device_snapshot(), ttl=secrets.get("device_snapshot_ttl", 5)
+)
+
+# The parsed flow table is shared by all flow-based endpoints
+flow_cache = SnapshotCache(
+    lambda: fetch_flow_snapshot(), ttl=secrets.get("flow_snapshot_ttl", 5)
+)
+
+# Called after the flow table was changed, e.g. by the caches of the asyncio server
+flow_invalidation_hooks = []
+
+# Large flow dumps can be parsed incrementally with bounded memory
+STREAM_FLOW_DUMPS = secrets.get("stream_flow_dumps", False)
+FLOW_DUMP_CHUNK_SIZE = 64 * 1024
+
+# Isolated devices are fetched with a filtered flow query, independent of the full table
+isolation_cache = SnapshotCache(
+    lambda: fetch_isolation_snapshot(), ttl=secrets.get("flow_snapshot_ttl", 5)
+)
+
+# Changes between snapshots are kept, so clients can poll for deltas with ?since=<version>
+CHANGE_LOG_SIZE = secrets.get("change_log_size", 100)
+device_log = ChangeLog(max_versions=CHANGE_LOG_SIZE)
+communication_log = ChangeLog(max_versions=CHANGE_LOG_SIZE)
+
+# Topology changes are pushed to the clients connected to /events
+events = EventBroker(
+    queue_size=secrets.get("events_queue_size", 256),
+    history_size=secrets.get("events_history_size", 1000),
+    heartbeat=secrets.get("events_heartbeat", 15),
+    on_subscribe=lambda: start_change_polling(),
+)
+
+# Every new snapshot is compared with the previous one once, all consumers get that diff
+diff_engine = DiffEngine()
+diff_engine.subscribe("devices", lambda *args: record_device_changes(*args))
+diff_engine.subscribe("flows", lambda *args: record_flow_changes(*args))
+
+# The desired isolation set by PUT /isolated_devices is enforced on all datapaths
+reconciler = IsolationReconciler(
+    lambda: fetch_installed_isolation(),
+    lambda command, mac, dpid: apply_isolation(command, mac, dpid),
+    flow_mod_pool,
+    interval=secrets.get("reconcile_interval", 60),
+    on_change=lambda: invalidate_flows(),
+)
+
+# Flow mods requested with ?async=1 are run by background workers
+job_queue = JobQueue(
+    workers=secrets.get("job_workers", 4),
+    queue_size=secrets.get("job_queue_size", 100),
+    on_finish=lambda job: events.publish(JOB_FINISHED, job.to_dict()),
+)
+
+# A finished job checks the flow tables this many times before it counts as failed
+JOB_VERIFY_ATTEMPTS = 3
+JOB_VERIFY_DELAY = 0.5
+
+# Traffic and reachability of every device are kept in ring buffers for /history/<mac>
+HISTORY_ENABLED = secrets.get("history_enabled", True)
+history = TimeSeriesStore(
+    {"traffic": (BYTE_RATE, PACKET_RATE), "device": ("reachable",)},
+    tiers=(
+        (0, secrets.get("history_raw_points", 360)),
+        (60, secrets.get("history_minute_points", 720)),
+        (900, secrets.get("history_quarter_points", 672)),
+    ),
+)
+
+# Changes of devices, communications and isolation are optionally written to SQLite
+HISTORY_DB = secrets.get("history_db")
+history_store = None
+if HISTORY_DB:
+    history_store = HistoryStore(
+        HISTORY_DB,
+        batch_interval=secrets.get("history_db_batch_interval", 10),
+        retention=secrets.get("history_db_retention_days", 30) * 86400,
+    )
+
+# Node positions of /topology are computed on the server, so the card only draws them
+LAYOUT_ENABLED = secrets.get("layout_enabled", True)
+layout_engine = LayoutEngine(
+    width=secrets.get("layout_width", 500),
+    height=secrets.get("layout_height", 500),
+    charge=secrets.get("layout_charge", -300),
+    iterations=secrets.get("layout_iterations", 120),
+)
+
+# Range of ?charge= on /topology, the range of graphForce in the card editor
+MIN_LAYOUT_CHARGE = -1000
+MAX_LAYOUT_CHARGE = 1000
+
+# Node of the virtual switch isolated devices are attached to in the software view
+VSWITCH_IP = "---.---.---.---"
+
+# In collector mode the read endpoints answer from snapshots polled in the background
+COLLECTOR_ENABLED = secrets.get("collector_enabled", False)
+collector = Collector()
+collector.add_source(
+    "devices",
+    lambda: collect(fetch_device_snapshot, device_cache),
+    secrets.get("collector_device_interval", 30),
+)
+collector.add_source(
+    "flows",
+    lambda: collect(fetch_flow_snapshot, flow_cache),
+    secrets.get("collector_flow_interval", 5),
+)
+
+# The history of /history/<mac> is sampled on the collector intervals, whether or not
+# requests arrive, so its tiers cover wall-clock time
+history_sampler = Collector()
+history_sampler.add_source(
+    "devices",
+    lambda: sample_device_history(),
+    secrets.get("collector_device_interval", 30),
+)
+history_sampler.add_source(
+    "flows",
+    lambda: sample_traffic_history(),
+    secrets.get("collector_flow_interval", 5),
+)
+
 
 @app.route("/devices")
 def get_devices():
     """
     Retrieve a list of all devices currently connected to the router.
     This is a code segment provided by the LuCi.rpc.
+
+    With ?since=<version> only the devices added, removed and changed since that version are returned.
+    With ?format=columnar the devices are returned as one array per field.
     """
     try:
-        router = OpenWrtRpc(ROUTER_IP, ROUTER_USER, ROUTER_PASSWORD)
-        result = router.get_all_connected_devices(only_reachable=False)
-
-        device_list = [device._asdict() for device in result]
-        return jsonify(device_list)
+        snapshot = current_devices()
+        return snapshot_response(snapshot, *devices_view(snapshot, request.args))
     except Exception as error:
         print(f"Failed to retrieve devices: {str(error)}")
         return jsonify({"error": str(error)}), 500
@@ -59,41 +277,42 @@ def get_devices():
 def get_communications():
     """
     Fetch communication details between connected devices.
+
+    With ?since=<version> only the communications added and removed since that version are returned.
+    With ?format=columnar the communications are returned as one array per field.
+    With ?traffic=1 the packet and byte counters and rates of each device pair are added.
     """
-    RYU_DATAPATH = get_switch_dpid()
+    try:
+        snapshot = current_flows()
+        return snapshot_response(
+            snapshot, *communications_view(snapshot, request.args)
+        )
 
-    if not RYU_DATAPATH:
+    except DatapathNotFound:
         print("No DPID found.")
         return jsonify({"status": "error", "message": "No DPID found."}), 500
+    except requests.RequestException as e:
+        print(f"Error during GET request: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
 
+
+@app.route("/communications/<mac_address>", methods=["GET"])
+def get_communication_partners(mac_address):
+    """
+    Return the MAC addresses a device communicated with.
+
+    Answered from an index built once per flow snapshot, so a node click doesn't download all communications.
+    With ?traffic=1 the counters and rates of the traffic with each peer are returned as well.
+    """
     try:
-        response = requests.get(
-            f"http://{RYU_ADDRESS}:{RYU_PORT}/stats/flow/{RYU_DATAPATH}"
+        snapshot = current_flows()
+        return snapshot_response(
+            snapshot, *peers_view(snapshot, mac_address, request.args)
         )
-        response.raise_for_status()
-        flows = response.json()
-
-        flows_for_dpid = flows.get(
-            str(RYU_DATAPATH), []
-        )  # Make sure to use the string representation
-
-        # Process the flow rules to extract the source and destination MAC addresses
-        communication_list = []
-        for flow in flows_for_dpid:
-            match = flow.get("match")
-            if match:
-                src_mac = match.get("dl_src")
-                dst_mac = match.get("dl_dst")
-                if src_mac and dst_mac:
-                    communication_list.append(
-                        {
-                            "source_mac": src_mac,
-                            "destination_mac": dst_mac,
-                        }
-                    )
-
-        return jsonify(communication_list), 200
 
+    except DatapathNotFound:
+        print("No DPID found.")
+        return jsonify({"status": "error", "message": "No DPID found."}), 500
     except requests.RequestException as e:
         print(f"Error during GET request: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -104,79 +323,129 @@ def get_isolated_devices():
     """
     Return all isolated devices.
     """
-    RYU_DATAPATH = get_switch_dpid()
+    try:
+        snapshot = current_isolation()
+        return snapshot_response(snapshot, *isolation_view(snapshot))
 
-    if not RYU_DATAPATH:
+    except DatapathNotFound:
         print("No DPID found.")
         return jsonify({"status": "error", "message": "No DPID found."}), 500
+    except requests.RequestException as e:
+        print(f"Error during GET request: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-    try:
-        response = requests.get(
-            f"http://{RYU_ADDRESS}:{RYU_PORT}/stats/flow/{RYU_DATAPATH}"
+
+@app.route("/isolated_devices", methods=["PUT"])
+def set_isolated_devices():
+    """
+    Set the complete list of isolated devices, given as JSON body {"macs": [...]}.
+
+    Only the rules that differ from the flow tables are added or strictly deleted. The
+    list is enforced again on a schedule, e.g. after a switch lost its rules.
+    """
+    body = request.get_json(silent=True) or {}
+    macs = body.get("macs")
+    if not isinstance(macs, list) or not all(isinstance(mac, str) for mac in macs):
+        return (
+            jsonify({"status": "error", "message": "Expected a list of MACs in 'macs'."}),
+            400,
         )
-        response.raise_for_status()
-        flows = response.json()
 
-        flows_for_dpid = flows.get(
-            str(RYU_DATAPATH), []
-        )  # Make sure to use the string representation
+    result = reconciler.set_desired(macs)
+    if not result["converged"]:
+        return jsonify({"status": "error", **result}), 500
+    return jsonify({"status": "success", **result}), 200
+
 
-        # Process the flow rules to extract the source MAC addresses of isolated devices
-        isolated_mac_addresses = []
-        for flow in flows_for_dpid:
-            actions = flow.get("actions", [])
-            match = flow.get("match", {})
+@app.route("/topology")
+def get_topology():
+    """
+    Return nodes, isolation flags and communication edges in one consistent response.
 
-            # If the actions list is empty and dl_src is present, consider it as an isolated device
-            if not actions and "dl_src" in match:
-                isolated_mac_addresses.append(match["dl_src"])
+    The devices are fetched from LuCI while the flow table is fetched from Ryu, and the
+    isolated devices are taken from the same flow table instead of a second query.
+    Nodes carry their position for the graph of the ?mode= (physical or software),
+    laid out with the repulsion given by ?charge=.
+    """
+    try:
+        layout_charge(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-        print(jsonify(isolated_mac_addresses))
-        return jsonify(isolated_mac_addresses), 200
+    try:
+        snapshot = current_topology()
+        return snapshot_response(snapshot, *topology_view(snapshot, request.args))
 
-    except requests.RequestException as e:
-        print(f"Error during GET request: {e}")
+    except DatapathNotFound:
+        print("No DPID found.")
+        return jsonify({"status": "error", "message": "No DPID found."}), 500
+    except Exception as e:
+        print(f"Failed to retrieve topology: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route("/events")
+def get_events():
+    """
+    Stream topology changes as Server-Sent Events.
+
+    Events are detected whenever a new snapshot is fetched. While clients are connected,
+    the router and Ryu are polled like in collector mode, so changes are found without
+    any other requests. A reconnecting client resumes after the event given by
+    Last-Event-ID.
+    """
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get(
+        "last_event_id"
+    )
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    return Response(
+        events.stream(last_event_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/isolate_mac/<mac_address>", methods=["POST"])
 def isolate_mac(mac_address):
     """
     Isolate a device by specifying its MAC address.
 
     The function achieves isolation by adding a flow rule to OVS with no actions effectively dropping packets.
+    With ?async=1 the flow rule is added by a background job and the job ID is returned at once.
     """
 
-    RYU_DATAPATH = get_switch_dpid()
-    post_payload = {
-        "dpid": RYU_DATAPATH,
-        "cookie": 1,
-        "cookie_mask": 1,
-        "table_id": 0,
-        "idle_timeout": 0,
-        "hard_timeout": 0,
-        "priority": 1000,
-        "flags": 1,
-        "match": {"dl_src": mac_address},
-        "actions": [],
-    }
+    if wants_job():
+        return queue_isolation_job("add", {"actions": []}, [mac_address])
+
+    RYU_DATAPATHS = get_switch_dpids()
+
+    if not RYU_DATAPATHS:
+        print("No DPID found.")
+        return jsonify({"status": "error", "message": "No DPID found."}), 500
+
+    post_payload = dict(isolation_rule(mac_address), actions=[])
+
+    # Declared first, so a reconciliation running meanwhile doesn't remove the rule
+    reconciler.isolate([mac_address])
 
     try:
-        response = requests.post(
-            f"http://{RYU_ADDRESS}:{RYU_PORT}/stats/flowentry/add",
-            json=post_payload,
-        )
-        response.raise_for_status()
+        responses = flow_mod_all("add", post_payload, RYU_DATAPATHS)
+        invalidate_flows()
 
         # Check if the response content is valid JSON or not
-        if response.text:  # if there is some response text
-            try:
-                json_content = response.json()
-                print(json_content)
-            except json.JSONDecodeError:
-                print("Received non-JSON response:", response.text)
-        else:
-            print("Received empty response from server")
+        for response in responses:
+            if response.text:  # if there is some response text
+                try:
+                    json_content = response.json()
+                    print(json_content)
+                except json.JSONDecodeError:
+                    print("Received non-JSON response:", response.text)
+            else:
+                print("Received empty response from server")
 
         return (
             jsonify({"status": "success", "message": "MAC isolated successfully"}),
@@ -193,79 +462,974 @@ def include_mac(mac_address):
     Remove isolation from a device.
 
     This function deletes the flow rule associated with the specified MAC address, enabling its communications again.
+    With ?async=1 the flow rule is deleted by a background job and the job ID is returned at once.
     """
 
-    url = f"http://{RYU_ADDRESS}:{RYU_PORT}/stats/flowentry/delete"
+    if wants_job():
+        return queue_isolation_job("delete", {}, [mac_address])
 
-    RYU_DATAPATH = get_switch_dpid()
-    post_payload = {
-        "dpid": RYU_DATAPATH,
-        "cookie": 1,
-        "cookie_mask": 1,
-        "table_id": 0,
-        "idle_timeout": 0,
-        "hard_timeout": 0,
-        "priority": 1000,
-        "flags": 1,
-        "match": {"dl_src": mac_address},
-    }
+    RYU_DATAPATHS = get_switch_dpids()
+
+    if not RYU_DATAPATHS:
+        print("No DPID found.")
+        return jsonify({"status": "error", "message": "No DPID found."}), 500
 
-    # Send the POST request
+    post_payload = isolation_rule(mac_address)
+
+    # Declared first, so a reconciliation running meanwhile doesn't add the rule again
+    reconciler.include([mac_address])
+
+    # Send the POST request to every datapath
     try:
-        response = requests.post(url, json=post_payload)
-        response.raise_for_status()
+        responses = flow_mod_all("delete", post_payload, RYU_DATAPATHS)
+        invalidate_flows()
 
         # Check if the response content is valid JSON or not
-        if response.text:  # if there's some response content
-            try:
-                json_content = response.json()
-                print(json_content)
-                return jsonify(json_content), 200
-            except json.JSONDecodeError:
-                print("Received non-JSON response:", response.text)
-                return (
-                    jsonify(
-                        {
-                            "status": "error",
-                            "message": "Received non-JSON response from server",
-                        }
-                    ),
-                    500,
-                )
-        else:
-            print("Received empty response from server")
-            return (
-                jsonify({"status": "success", "message": "MAC included successfully"}),
-                200,
-            )
+        json_contents = []
+        for response in responses:
+            if response.text:  # if there's some response content
+                try:
+                    json_content = response.json()
+                    print(json_content)
+                    json_contents.append(json_content)
+                except json.JSONDecodeError:
+                    print("Received non-JSON response:", response.text)
+                    return (
+                        jsonify(
+                            {
+                                "status": "error",
+                                "message": "Received non-JSON response from server",
+                            }
+                        ),
+                        500,
+                    )
+            else:
+                print("Received empty response from server")
+
+        if len(json_contents) == 1:
+            return jsonify(json_contents[0]), 200
+        if json_contents:
+            return jsonify(json_contents), 200
+        return (
+            jsonify({"status": "success", "message": "MAC included successfully"}),
+            200,
+        )
 
     except requests.RequestException as e:
         print(f"Error during POST request: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-def get_switch_dpid():
+@app.route("/isolate_macs", methods=["POST"])
+def isolate_macs():
+    """
+    Isolate several devices at once, given as JSON body {"macs": [...]}.
+
+    All flow mods are sent to Ryu concurrently and the status of every MAC is returned.
+    """
+    return bulk_isolation("add", {"actions": []})
+
+
+@app.route("/include_macs", methods=["POST"])
+def include_macs():
+    """
+    Remove the isolation of several devices at once, given as JSON body {"macs": [...]}.
+    """
+    return bulk_isolation("delete", {})
+
+
+def bulk_isolation(command, extra):
+    """
+    Send the isolation flow mod `command` for every MAC of the request to every datapath.
+
+    Returns the status of every MAC, which failed if any of its flow mods failed.
+    With ?async=1 the flow mods are queued as job instead.
+    """
+    body = request.get_json(silent=True) or {}
+    macs = body.get("macs")
+    if not isinstance(macs, list) or not all(isinstance(mac, str) for mac in macs):
+        return (
+            jsonify({"status": "error", "message": "Expected a list of MACs in 'macs'."}),
+            400,
+        )
+
+    # Every MAC is sent once, even if it is listed several times
+    macs = list(dict.fromkeys(macs))
+
+    if wants_job():
+        return queue_isolation_job(command, extra, macs)
+
+    RYU_DATAPATHS = get_switch_dpids()
+
+    if not RYU_DATAPATHS:
+        print("No DPID found.")
+        return jsonify({"status": "error", "message": "No DPID found."}), 500
+
+    payload = isolation_summary(run_isolation(command, extra, macs, RYU_DATAPATHS))
+    return jsonify(payload), 200 if payload["status"] == "success" else 500
+
+
+@app.route("/jobs/<job_id>")
+def get_job(job_id):
+    """
+    Return the status of a queued flow mod job.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job."}), 404
+    return jsonify(job), 200
+
+
+def wants_job():
+    """
+    Return whether the request asks for its flow mods to be queued with ?async=1.
     """
-    Retrieve the Data Path Identifier from the Ryu controller.
+    return request.args.get("async", "").lower() in ("1", "true", "yes")
+
+
+def queue_isolation_job(command, extra, macs):
     """
+    Queue the isolation flow mods of the given MACs and answer with the job ID at once.
+    """
+    kind = "isolate" if command == "add" else "include"
     try:
-        url = f"http://{RYU_ADDRESS}:{RYU_PORT}/stats/switches"
-        response = requests.get(url, timeout=5)
+        job = job_queue.submit(
+            kind, macs, lambda: isolation_job(command, extra, macs)
+        )
+    except QueueFull:
+        print("Job queue is full.")
+        return jsonify({"status": "error", "message": "Job queue is full."}), 503
+    return jsonify({"status": "accepted", "job": job.id}), 202
 
-        if response.ok:
-            switches = response.json()
-            if switches:
-                return switches[0]
-            else:
-                print("No switches found.")
-                return 251096700645801  # As default
-        else:
-            print(f"Failed to retrieve switches. Status code: {response.status_code}")
-            return None
-    except Exception as error:
-        print(f"Error while retrieving DPID: {str(error)}")
-        return None
 
+def isolation_job(command, extra, macs):
+    """
+    Run queued isolation flow mods and check that the flow tables reflect them.
+    """
+    RYU_DATAPATHS = get_switch_dpids()
+
+    if not RYU_DATAPATHS:
+        return {"status": "error", "message": "No DPID found."}
+
+    results = run_isolation(command, extra, macs, RYU_DATAPATHS)
+    verify_isolation(results, isolated=command == "add")
+    return isolation_summary(results)
+
+
+def run_isolation(command, extra, macs, dpids):
+    """
+    Send the isolation flow mods of all MACs to all datapaths concurrently.
+
+    Returns the status of every MAC.
+    """
+    # Declared first, so a reconciliation running meanwhile doesn't undo the flow mods
+    if command == "add":
+        reconciler.isolate(macs)
+    else:
+        reconciler.include(macs)
+
+    futures = {
+        mac: [
+            flow_mod_pool.submit(
+                flow_mod, command, dict(isolation_rule(mac), dpid=dpid, **extra)
+            )
+            for dpid in dpids
+        ]
+        for mac in macs
+    }
+
+    results = {}
+    for mac, mac_futures in futures.items():
+        results[mac] = {"status": "success"}
+        for future in mac_futures:
+            try:
+                future.result()
+            except requests.RequestException as e:
+                print(f"Error during POST request for {mac}: {e}")
+                results[mac] = {"status": "error", "message": str(e)}
+
+    invalidate_flows()
+
+    return results
+
+
+def verify_isolation(results, isolated):
+    """
+    Mark every successful MAC as verified once all flow tables show it (not) isolated.
+
+    Ryu answers flow mods before the switch applied them, so the check is retried a few times.
+    """
+    pending = {
+        canonical_mac(mac): result
+        for mac, result in results.items()
+        if result["status"] == "success"
+    }
+
+    for attempt in range(JOB_VERIFY_ATTEMPTS):
+        if attempt:
+            time.sleep(JOB_VERIFY_DELAY)
+        try:
+            installed = fetch_installed_isolation()
+        except DatapathNotFound:
+            continue
+
+        tables = [
+            {canonical_mac(mac) for mac in macs}
+            for macs in installed.values()
+            if not isinstance(macs, Exception)
+        ]
+        if len(tables) < len(installed):
+            continue
+
+        for mac in list(pending):
+            if all((mac in table) == isolated for table in tables):
+                pending.pop(mac)["verified"] = True
+        if not pending:
+            return
+
+    for result in pending.values():
+        result.update(
+            status="error",
+            verified=False,
+            message="The flow mod was accepted, but the flow tables don't reflect it.",
+        )
+
+
+def isolation_summary(results):
+    """
+    Return the response payload for the per-MAC results of isolation flow mods.
+    """
+    failed = sum(1 for result in results.values() if result["status"] == "error")
+    if failed:
+        return {
+            "status": "error",
+            "message": f"{failed} of {len(results)} MACs failed",
+            "results": results,
+        }
+    return {"status": "success", "results": results}
+
+
+@app.route("/datapaths")
+def get_datapaths():
+    """
+    Return the age of the flow table and the last error of every datapath.
+    """
+    try:
+        snapshot = current_flows()
+        return jsonify(snapshot.datapaths()), 200
+
+    except DatapathNotFound:
+        print("No DPID found.")
+        return jsonify({"status": "error", "message": "No DPID found."}), 500
+    except requests.RequestException as e:
+        print(f"Error during GET request: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route("/history/<mac_address>")
+def get_history(mac_address):
+    """
+    Return the traffic and reachability of a device over the last ?window= (e.g. 15m, 6h, 7d).
+
+    Short windows are answered with every sample, longer ones with one-minute or
+    15-minute averages.
+    """
+    if not HISTORY_ENABLED:
+        return jsonify({"status": "error", "message": "History is disabled."}), 404
+
+    try:
+        window = parse_window(request.args.get("window"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    mac = canonical_mac(mac_address)
+    return (
+        jsonify({"mac": mac, "window": window, "series": history.query(mac, window)}),
+        200,
+    )
+
+
+@app.route("/history/topology/<kind>")
+def get_topology_history(kind):
+    """
+    Return the devices, communications or isolated devices (<kind>) stored in SQLite.
+
+    With ?at= the records present at that time are returned, by default now. With
+    ?start= and optionally ?end=, the records present at the start and every change
+    within the range. Times are Unix timestamps or ISO 8601 strings.
+    """
+    if history_store is None:
+        message = "History store is disabled."
+        return jsonify({"status": "error", "message": message}), 404
+    if kind not in KINDS:
+        return jsonify({"status": "error", "message": f"Unknown kind: {kind}"}), 404
+
+    try:
+        now = time.time()
+        at = parse_time(request.args.get("at"))
+        start = parse_time(request.args.get("start"))
+        end = parse_time(request.args.get("end"), now)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if start is None:
+        at = now if at is None else at
+        return jsonify({"at": at, "items": history_store.state_at(kind, at)}), 200
+
+    return (
+        jsonify(
+            {
+                "start": start,
+                "end": end,
+                "items": history_store.state_at(kind, start),
+                "changes": history_store.changes(kind, start, end),
+            }
+        ),
+        200,
+    )
+
+
+@app.route("/upstream_stats")
+def get_upstream_stats():
+    """
+    Return request counters and connection reuse of the upstream connection pools.
+    """
+    return jsonify(upstream_stats()), 200
+
+
+def upstream_stats():
+    """
+    Collect the statistics of the upstream clients, the event stream and the collector.
+    """
+    stats = {
+        "ryu": ryu.stats(),
+        "luci": luci.stats(),
+        "event_subscribers": events.subscriber_count(),
+        "reconciler": reconciler.status(),
+        "jobs": job_queue.stats(),
+    }
+    if COLLECTOR_ENABLED:
+        stats["collector"] = collector.status()
+    if HISTORY_ENABLED:
+        stats["history"] = history.stats()
+    if history_store is not None:
+        stats["history_store"] = history_store.stats()
+    if LAYOUT_ENABLED:
+        stats["layout"] = layout_engine.stats()
+    return stats
+
+
+def devices_view(snapshot, args):
+    """
+    Return the cache key and payload builder of a /devices request.
+
+    The views are shared with the asyncio server, so both serve the same payloads.
+    """
+    since = args.get("since", type=int)
+    if since is not None:
+        return ("devices", since), delta(
+            snapshot, device_log, since, lambda: snapshot.devices
+        )
+    if args.get("format") == "columnar":
+        return ("devices", "columnar"), lambda: columnar_devices(snapshot.devices)
+    return "devices", lambda: snapshot.devices
+
+
+def communications_view(snapshot, args):
+    """
+    Return the cache key and payload builder of a /communications request.
+
+    With ?traffic=1 every communication has the counters and rates of its device pair.
+    """
+    since = args.get("since", type=int)
+    if since is not None:
+        return ("communications", since), delta(
+            snapshot, communication_log, since, lambda: snapshot.communications
+        )
+
+    traffic = wants_traffic(args)
+    if args.get("format") == "columnar":
+        return ("communications", "columnar", traffic), lambda: columnar_communications(
+            snapshot.source_macs,
+            snapshot.destination_macs,
+            snapshot.dpid_column,
+            traffic_columns(snapshot) if traffic else None,
+        )
+    if traffic:
+        return ("communications", "traffic"), lambda: [
+            dict(communication, **record)
+            for communication, record in zip(
+                snapshot.communications, traffic_records(snapshot)
+            )
+        ]
+    return "communications", lambda: snapshot.communications
+
+
+def peers_view(snapshot, mac_address, args):
+    """
+    Return the cache key and payload builder of a /communications/<mac> request.
+
+    With ?traffic=1 the peers are returned with the traffic exchanged with them.
+    """
+    mac = canonical_mac(mac_address)
+    if wants_traffic(args):
+        return ("peers", mac, "traffic"), lambda: peer_traffic(
+            snapshot_traffic(snapshot), mac
+        )
+    return ("peers", mac), lambda: sorted(snapshot.peers(mac_address))
+
+
+def wants_traffic(args):
+    """
+    Return whether a request asks for traffic counters with ?traffic=1.
+    """
+    return args.get("traffic", "").lower() in ("1", "true", "yes")
+
+
+def traffic_records(snapshot):
+    """
+    Return the traffic record of the device pair of each communication, in order.
+    """
+    traffic = snapshot_traffic(snapshot)
+    return [
+        traffic[
+            (
+                canonical_mac(communication["source_mac"]),
+                canonical_mac(communication["destination_mac"]),
+                communication["dpid"],
+            )
+        ]
+        for communication in snapshot.communications
+    ]
+
+
+def traffic_columns(snapshot):
+    """
+    Return the traffic records of all communications as one column per field.
+    """
+    records = traffic_records(snapshot)
+    return {field: [record[field] for record in records] for field in TRAFFIC_FIELDS}
+
+
+def isolation_view(snapshot):
+    """
+    Return the cache key and payload builder of an /isolated_devices request.
+    """
+    return "isolated_devices", lambda: snapshot.isolated_macs
+
+
+def topology_view(snapshot, args):
+    """
+    Return the cache key and payload builder of a /topology request.
+
+    Raises ValueError for an invalid ?charge=.
+    """
+    software = args.get("mode") == "software"
+    charge = layout_charge(args)
+
+    def build():
+        payload = {
+            "snapshot": snapshot.snapshot_id,
+            "nodes": snapshot.nodes(),
+            "edges": snapshot.flow_snapshot.communications,
+        }
+        if LAYOUT_ENABLED:
+            positions = topology_layout(snapshot, software, charge)
+            for node in payload["nodes"]:
+                position = positions.get(node.get("ip"))
+                if position is not None:
+                    node["x"], node["y"] = position
+            hosts = [ROUTER_IP, VSWITCH_IP] if software else [ROUTER_IP]
+            payload["hosts"] = [
+                {"ip": ip, "x": positions[ip][0], "y": positions[ip][1]}
+                for ip in hosts
+            ]
+        return payload
+
+    mode = "software" if software else "physical"
+    return f"topology:{mode}:{charge:g}", build
+
+
+def layout_charge(args):
+    """
+    Return the repulsion of the layout, set by the card with ?charge= like graphForce.
+    """
+    charge = args.get("charge")
+    if charge is None:
+        return layout_engine.charge
+
+    try:
+        value = float(charge)
+    except ValueError:
+        value = None
+    if value is None or not MIN_LAYOUT_CHARGE <= value <= MAX_LAYOUT_CHARGE:
+        raise ValueError(f"Invalid charge: {charge}")
+    return value
+
+
+def topology_layout(snapshot, software, charge=None):
+    """
+    Return the position of every node of the graph drawn by the card, by IP address.
+
+    Like the card, the graph has a node per IP address, linked to the node of its host.
+    In the software view isolated devices are attached to the virtual switch instead.
+    A device whose IP changed starts at the position of its previous IP.
+    """
+    charge = layout_engine.charge if charge is None else charge
+
+    def build():
+        ips = [ROUTER_IP, VSWITCH_IP] if software else [ROUTER_IP]
+        nodes = [node for node in snapshot.nodes() if node.get("ip")]
+        identities = {}
+        for node in nodes:
+            ips.append(node["ip"])
+            mac = canonical_mac(node.get("mac") or "")
+            if mac:
+                identities[node["ip"]] = mac
+
+        links = [(ROUTER_IP, VSWITCH_IP)] if software else []
+        for node in nodes:
+            host = VSWITCH_IP if software and node["isolated"] else node.get("host")
+            if host in ips and host != node["ip"]:
+                links.append((host, node["ip"]))
+
+        # Each view and charge continues its own previous layout
+        mode = "software" if software else "physical"
+        return layout_engine.positions(
+            ips,
+            links,
+            name=f"{mode}:{charge:g}",
+            charge=charge,
+            identities=identities,
+        )
+
+    return snapshot.memo(("layout", software, charge), build)
+
+
+def current_devices():
+    """
+    Return the latest device snapshot.
+
+    In collector mode this is the last polled snapshot, otherwise the shared device
+    cache is used.
+    """
+    if COLLECTOR_ENABLED:
+        snapshot = collector.latest("devices")
+        if snapshot is not None:
+            return snapshot
+    return device_cache.get()
+
+
+def current_flows():
+    """
+    Return the latest flow snapshot.
+
+    In collector mode this is the last polled snapshot, otherwise the shared flow cache is used.
+    """
+    if COLLECTOR_ENABLED:
+        snapshot = collector.latest("flows")
+        if snapshot is not None:
+            return snapshot
+    return flow_cache.get()
+
+
+def current_isolation():
+    """
+    Return the latest snapshot of the isolated devices.
+
+    In collector mode the full flow table is polled anyway and the isolated devices are
+    taken from it. Otherwise only the isolation rules are fetched.
+    """
+    if COLLECTOR_ENABLED:
+        snapshot = collector.latest("flows")
+        if snapshot is not None:
+            return snapshot
+    return isolation_cache.get()
+
+
+def current_topology():
+    """
+    Return the latest devices and flow table as one topology snapshot.
+
+    Both upstreams are queried at the same time, so the request takes as long as the slower one.
+    """
+    devices = upstream_pool.submit(current_devices)
+    flows = current_flows()
+    return topology_snapshot(devices.result(), flows)
+
+
+def topology_snapshot(device_snapshot, flow_snapshot):
+    """
+    Combine a device and a flow snapshot, reusing the last topology if neither changed.
+
+    In collector mode most requests see the same pair, so the payload is serialized once.
+    """
+    global last_topology
+    with last_topology_lock:
+        topology = last_topology
+        if (
+            topology is None
+            or topology.device_snapshot is not device_snapshot
+            or topology.flow_snapshot is not flow_snapshot
+        ):
+            topology = TopologySnapshot(device_snapshot, flow_snapshot)
+            last_topology = topology
+        return topology
+
+
+def invalidate_flows():
+    """
+    Make sure the next flow snapshot reflects a change to the flow table.
+    """
+    flow_cache.invalidate()
+    isolation_cache.invalidate()
+    for hook in flow_invalidation_hooks:
+        hook()
+    if COLLECTOR_ENABLED:
+        collector.refresh("flows")
+
+
+def publish_events(diff):
+    """
+    Push the typed changes of a diff to the event stream.
+    """
+    for event_type, data in change_events(diff):
+        events.publish(event_type, data)
+
+
+def fetch_device_snapshot():
+    """
+    Retrieve all devices connected to the router from LuCI.
+    """
+    result = luci.get_all_connected_devices(only_reachable=False)
+    return publish_device_snapshot(
+        DeviceSnapshot(device._asdict() for device in result)
+    )
+
+
+def publish_device_snapshot(snapshot):
+    """
+    Hand a new device snapshot to the diff engine, which versions it.
+    """
+    diff_engine.publish("devices", snapshot)
+    return snapshot
+
+
+def record_device_changes(snapshot, diff):
+    """
+    Version a new device snapshot and pass its changes to the event stream and history.
+    """
+    snapshot.version = device_log.publish_changes(diff.records)
+    publish_events(diff)
+
+    if history_store is not None:
+        history_store.record_devices(snapshot.fetched_at, diff, snapshot.devices)
+
+
+def fetch_flow_snapshot():
+    """
+    Download and parse the flow tables of all switches.
+
+    Called by the flow cache, which makes sure only one dump runs at a time. The
+    datapaths are fetched in parallel by the datapath pool.
+    """
+    RYU_DATAPATHS = get_switch_dpids()
+
+    if not RYU_DATAPATHS:
+        raise DatapathNotFound()
+
+    futures = {
+        dpid: datapath_pool.submit(fetch_datapath_flows, dpid) for dpid in RYU_DATAPATHS
+    }
+    results = {}
+    for dpid, future in futures.items():
+        try:
+            results[dpid] = future.result()
+        except (requests.RequestException, ValueError) as e:
+            results[dpid] = e
+
+    return publish_flow_snapshot(merge_datapath_snapshots(results))
+
+
+def fetch_datapath_flows(dpid):
+    """
+    Download and parse the flow table of one switch.
+    """
+    if STREAM_FLOW_DUMPS:
+        # Walk the flow array entry by entry instead of loading the whole dump
+        response = ryu.get(f"/stats/flow/{dpid}", stream=True)
+        try:
+            check_datapath(response)
+            response.raise_for_status()
+            return FlowSnapshot(
+                dpid, iter_flows(response.iter_content(FLOW_DUMP_CHUNK_SIZE), dpid)
+            )
+        finally:
+            response.close()
+
+    response = ryu.get(f"/stats/flow/{dpid}")
+    check_datapath(response)
+    response.raise_for_status()
+    flows = response.json()
+
+    flows_for_dpid = flows.get(str(dpid), [])  # Make sure to use the string representation
+
+    return FlowSnapshot(dpid, flows_for_dpid)
+
+
+def merge_datapath_snapshots(results):
+    """
+    Merge the flow snapshots of all datapaths, given as dict of DPID to snapshot or error.
+
+    A failed datapath keeps its last snapshot. Raises the first error if no datapath
+    has a snapshot at all.
+    """
+    global datapath_snapshots
+    snapshots = {}
+    errors = {}
+
+    with datapath_snapshots_lock:
+        for dpid, result in results.items():
+            previous = datapath_snapshots.get(dpid)
+            if isinstance(result, Exception):
+                print(f"Failed to fetch the flows of datapath {dpid}: {result}")
+                errors[dpid] = str(result)
+                result = previous
+                if result is None:
+                    continue
+            elif previous is not None:
+                result.rates = compute_rates(previous, result)
+            snapshots[dpid] = result
+
+        # Datapaths that are gone are dropped with the next dump
+        datapath_snapshots = dict(snapshots)
+
+    if not snapshots:
+        raise next(r for r in results.values() if isinstance(r, Exception))
+
+    return NetworkFlowSnapshot(snapshots, errors)
+
+
+def publish_flow_snapshot(snapshot):
+    """
+    Hand a new flow snapshot to the diff engine, which versions it.
+    """
+    diff_engine.publish("flows", snapshot)
+    return snapshot
+
+
+def record_flow_changes(snapshot, diff):
+    """
+    Version a new flow snapshot and pass its changes to the event stream and history.
+    """
+    snapshot.version = communication_log.publish_changes(diff.records)
+    publish_events(diff)
+
+    if history_store is not None:
+        history_store.record_communications(
+            snapshot.fetched_at, diff, snapshot.communications
+        )
+        history_store.record_isolation(
+            snapshot.fetched_at, diff, snapshot.isolated_macs
+        )
+
+
+def fetch_isolation_snapshot():
+    """
+    Fetch only the isolation rules of all switches.
+
+    Ryu filters the flow stats by table, cookie and priority, so the response grows with
+    the number of isolated devices instead of the size of the flow table. If a filtered
+    query fails, the isolated devices are taken from the full flow tables.
+    """
+    RYU_DATAPATHS = get_switch_dpids()
+
+    if not RYU_DATAPATHS:
+        raise DatapathNotFound()
+
+    futures = [
+        datapath_pool.submit(fetch_datapath_isolation, dpid) for dpid in RYU_DATAPATHS
+    ]
+    try:
+        return IsolationSnapshot.merge([future.result() for future in futures])
+    except (requests.RequestException, ValueError) as e:
+        print(f"Filtered flow query failed, scanning the full flow table: {e}")
+        snapshot = flow_cache.get()
+        return IsolationSnapshot(snapshot.dpids, snapshot.isolated_macs)
+
+
+def fetch_datapath_isolation(dpid):
+    """
+    Fetch the isolation rules of one switch with a filtered flow query.
+    """
+    response = ryu.post(f"/stats/flow/{dpid}", json=ISOLATION_FILTER)
+    check_datapath(response)
+    response.raise_for_status()
+    flows = response.json()
+    return IsolationSnapshot.from_flows(dpid, flows.get(str(dpid), []))
+
+
+def isolation_rule(mac_address):
+    """
+    Return the flow mod payload of the isolation rule of a MAC, without DPID and actions.
+    """
+    return {
+        "cookie": ISOLATION_COOKIE,
+        "cookie_mask": ISOLATION_COOKIE,
+        "table_id": 0,
+        "idle_timeout": 0,
+        "hard_timeout": 0,
+        "priority": ISOLATION_PRIORITY,
+        "flags": 1,
+        "match": {"dl_src": mac_address},
+    }
+
+
+def fetch_installed_isolation():
+    """
+    Fetch the isolated MACs installed on every datapath, bypassing the caches.
+
+    Returns a dict of DPID to MACs, or to the error of a failed query.
+    """
+    RYU_DATAPATHS = get_switch_dpids()
+
+    if not RYU_DATAPATHS:
+        raise DatapathNotFound()
+
+    futures = {
+        dpid: datapath_pool.submit(fetch_datapath_isolation, dpid)
+        for dpid in RYU_DATAPATHS
+    }
+    installed = {}
+    for dpid, future in futures.items():
+        try:
+            installed[dpid] = future.result().isolated_macs
+        except (requests.RequestException, ValueError) as e:
+            installed[dpid] = e
+    return installed
+
+
+def apply_isolation(command, mac_address, dpid):
+    """
+    Add or strictly delete the isolation rule of a MAC on one datapath.
+    """
+    payload = dict(isolation_rule(mac_address), dpid=dpid)
+    if command == "add":
+        payload["actions"] = []
+    return flow_mod(command, payload)
+
+
+def flow_mod_all(command, payload, dpids):
+    """
+    Send a flow mod to every given datapath in parallel and return the responses.
+
+    Raises the first error after all flow mods were answered.
+    """
+    futures = [
+        flow_mod_pool.submit(flow_mod, command, dict(payload, dpid=dpid))
+        for dpid in dpids
+    ]
+    wait(futures)
+    return [future.result() for future in futures]
+
+
+def flow_mod(command, payload):
+    """
+    Send a single flow mod command like "add" or "delete" to Ryu.
+    """
+    response = ryu.post(f"/stats/flowentry/{command}", json=payload)
+    check_datapath(response)
+    response.raise_for_status()
+    return response
+
+
+def get_switch_dpids():
+    """
+    Retrieve the Data Path Identifiers of all switches known to the Ryu controller.
+
+    Returns an empty list if Ryu does not know any switch.
+    """
+    return list(dpid_registry.switches() or [])
+
+
+def check_datapath(response):
+    """
+    Drop the cached DPID if Ryu answered that the datapath does not exist.
+
+    Ryu returns 404 for unknown datapaths, e.g. after OVS reconnected with a new DPID.
+    The next request resolves the DPID again.
+    """
+    if response.status_code == 404:
+        print("Datapath not found, invalidating cached DPID.")
+        dpid_registry.invalidate()
+
+
+def sample_device_history():
+    """
+    Record the reachability of every device in the history, on the device interval.
+    """
+    snapshot = current_devices()
+    reachable = {
+        mac: (1.0 if device.get("reachable") else 0.0,)
+        for mac, device in devices_by_mac(snapshot).items()
+        if mac
+    }
+    history.record("device", time.time(), reachable)
+    return snapshot
+
+
+def sample_traffic_history():
+    """
+    Record the traffic rates of every device in the history, on the flow interval.
+    """
+    snapshot = current_flows()
+
+    # Rates exist from the second dump of a datapath on
+    if any(part.rates is not None for part in snapshot.per_datapath().values()):
+        history.record("traffic", time.time(), device_rates(snapshot_traffic(snapshot)))
+    return snapshot
+
+
+def collect(fetch, cache):
+    """
+    Return a new snapshot for the collector.
+
+    In collector mode the collector is the only reader of the upstreams. Otherwise it
+    only polls for /events clients and shares the cache with the read endpoints, so
+    the upstreams are not queried twice.
+    """
+    if COLLECTOR_ENABLED:
+        return fetch()
+    return cache.get()
+
+
+def start_change_polling():
+    """
+    Poll for changes while clients listen to /events, if collector mode is disabled.
+    """
+    if COLLECTOR_ENABLED:
+        return
+    collector.start(active=lambda: events.subscriber_count() > 0)
+
+    # Polling was paused while nobody listened
+    if events.subscriber_count() == 1:
+        collector.refresh()
+
+
+if history_store is not None:
+    history_store.start()
+    atexit.register(history_store.close)
+
+# Start polling once all fetch functions are defined
+if COLLECTOR_ENABLED:
+    collector.start()
+
+    # Requests before the first poll would have to ask the upstreams themselves
+    if not collector.wait_ready(secrets.get("collector_startup_timeout", 30)):
+        print("The first collector poll did not finish in time.")
+
+if HISTORY_ENABLED:
+    history_sampler.start()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
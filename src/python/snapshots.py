@@ -0,0 +1,440 @@
+"""
+snapshots.py - Parsed snapshots of the upstream state and caches to share them between requests.
+
+This module provides:
+- Immutable snapshots of the connected devices and of the flow tables of the datapaths
+- Snapshots of the isolated devices alone, fetched with a filtered flow query
+- Topology snapshots combining devices and flows fetched for the same request
+- A TTL cache that lets concurrent requesters wait on a single in-flight fetch
+- The same cache for coroutines, used by the asyncio server
+"""
+
+import asyncio
+import sys
+import threading
+import time
+
+
+class Snapshot:
+    """
+    Base class of all snapshots, remembering when the data was fetched.
+
+    Snapshots are never changed after they are created, so they can be handed to any
+    number of request threads without copying.
+    """
+
+    def __init__(self):
+        self.fetched_at = time.time()
+        self.version = 0
+        self._memo = {}
+
+    def memo(self, key, build):
+        """
+        Return a value derived from the snapshot, calling `build` only the first time.
+
+        Used to serialize a response once per snapshot instead of once per request.
+        """
+        value = self._memo.get(key)
+        if value is None:
+            value = build()
+            self._memo[key] = value
+        return value
+
+    def memoized(self, key):
+        """
+        Return a value derived before with memo(), or None if it was not built yet.
+        """
+        return self._memo.get(key)
+
+    def age(self):
+        """
+        Return the number of seconds since the snapshot was fetched.
+        """
+        return max(time.time() - self.fetched_at, 0.0)
+
+
+class DeviceSnapshot(Snapshot):
+    """
+    Devices connected to the router as reported by LuCI.
+    """
+
+    def __init__(self, devices):
+        super().__init__()
+        self.devices = tuple(devices)
+
+
+class FlowSnapshot(Snapshot):
+    """
+    Flow table of one datapath, parsed once when it is fetched.
+
+    Communications and isolated devices are derived from the same flow list, so both
+    endpoints answer from one consistent view of the switch.
+    """
+
+    def __init__(self, dpid, flows):
+        super().__init__()
+        self.dpid = dpid
+        communications = []
+        isolated_macs = []
+
+        # (source MAC, destination MAC, in_port) -> (packets, bytes, duration) of each flow
+        self.flow_counters = {}
+
+        # Packet and byte rate per pair, set once the previous snapshot is known
+        self.rates = None
+
+        for flow in flows:
+            match = flow.get("match") or {}
+            src_mac = match.get("dl_src")
+            dst_mac = match.get("dl_dst")
+
+            # Flows with source and destination MAC describe a communication
+            if src_mac and dst_mac:
+                # The same MACs appear in many flows, keep one copy of each
+                src_mac = sys.intern(src_mac)
+                dst_mac = sys.intern(dst_mac)
+                communications.append(
+                    {
+                        "source_mac": src_mac,
+                        "destination_mac": dst_mac,
+                        "dpid": dpid,
+                    }
+                )
+                self._count(flow, (src_mac, dst_mac, match.get("in_port")))
+
+            if is_isolation_flow(flow):
+                isolated_macs.append(match["dl_src"])
+
+        self._index(communications, isolated_macs)
+
+    def _count(self, flow, key):
+        packets = flow.get("packet_count", 0)
+        octets = flow.get("byte_count", 0)
+        duration = flow.get("duration_sec", 0)
+
+        # Flows differing only in fields the key ignores are counted together
+        previous = self.flow_counters.get(key)
+        if previous is not None:
+            packets += previous[0]
+            octets += previous[1]
+            duration = min(duration, previous[2])
+        self.flow_counters[key] = (packets, octets, duration)
+
+    def per_datapath(self):
+        """
+        Return the snapshot of every datapath this snapshot consists of.
+        """
+        return {self.dpid: self}
+
+    def _index(self, communications, isolated_macs):
+        self.communications = tuple(communications)
+        self.isolated_macs = tuple(isolated_macs)
+
+        # The same communications as columns, for the columnar response format
+        self.source_macs = tuple(c["source_mac"] for c in self.communications)
+        self.destination_macs = tuple(c["destination_mac"] for c in self.communications)
+        self.dpid_column = tuple(c["dpid"] for c in self.communications)
+
+    def peers(self, mac):
+        """
+        Return the MAC addresses the given device communicated with, in either direction.
+        """
+        return self.memo("adjacency", self._build_adjacency).get(
+            canonical_mac(mac), frozenset()
+        )
+
+    def _build_adjacency(self):
+        # MAC -> set of peers, built once per snapshot on the first lookup
+        adjacency = {}
+        for communication in self.communications:
+            src_mac = canonical_mac(communication["source_mac"])
+            dst_mac = canonical_mac(communication["destination_mac"])
+            adjacency.setdefault(src_mac, set()).add(dst_mac)
+            adjacency.setdefault(dst_mac, set()).add(src_mac)
+        return {mac: frozenset(peers) for mac, peers in adjacency.items()}
+
+
+class NetworkFlowSnapshot(FlowSnapshot):
+    """
+    Flow tables of all datapaths merged into one graph.
+
+    Every communication names the datapath it was seen on. A datapath whose dump failed
+    keeps its previous snapshot, if there is one, and the error is reported next to it.
+    """
+
+    def __init__(self, snapshots, errors=None):
+        Snapshot.__init__(self)
+        self.snapshots = dict(snapshots)
+        self.errors = dict(errors or {})
+        self.dpids = tuple(self.snapshots)
+
+        # The first datapath, for callers that only know a single switch
+        self.dpid = self.dpids[0] if self.dpids else None
+        if self.snapshots:
+            self.fetched_at = min(s.fetched_at for s in self.snapshots.values())
+
+        communications = []
+        isolated_macs = {}
+        for snapshot in self.snapshots.values():
+            communications.extend(snapshot.communications)
+            for mac in snapshot.isolated_macs:
+                isolated_macs.setdefault(mac, None)
+
+        self._index(communications, isolated_macs)
+
+    def per_datapath(self):
+        """
+        Return the snapshot of every datapath this snapshot consists of.
+        """
+        return dict(self.snapshots)
+
+    def datapaths(self):
+        """
+        Return the freshness and the last error of every datapath.
+        """
+        status = {}
+        for dpid in set(self.snapshots) | set(self.errors):
+            snapshot = self.snapshots.get(dpid)
+            status[str(dpid)] = {
+                "age": round(snapshot.age(), 1) if snapshot else None,
+                "communications": len(snapshot.communications) if snapshot else 0,
+                "isolated_devices": len(snapshot.isolated_macs) if snapshot else 0,
+                "error": self.errors.get(dpid),
+            }
+        return status
+
+
+class IsolationSnapshot(Snapshot):
+    """
+    Isolated devices of the datapaths, without the rest of the flow tables.
+    """
+
+    def __init__(self, dpids, isolated_macs):
+        super().__init__()
+        self.dpids = tuple(dpids)
+        self.isolated_macs = tuple(isolated_macs)
+
+    @classmethod
+    def from_flows(cls, dpid, flows):
+        """
+        Create the snapshot from a list of flows, e.g. the result of a filtered flow query.
+        """
+        return cls(
+            (dpid,),
+            [flow["match"]["dl_src"] for flow in flows if is_isolation_flow(flow)],
+        )
+
+    @classmethod
+    def merge(cls, snapshots):
+        """
+        Combine the snapshots of several datapaths, a device isolated on any of them is listed once.
+        """
+        dpids = []
+        isolated_macs = {}
+        for snapshot in snapshots:
+            dpids.extend(snapshot.dpids)
+            for mac in snapshot.isolated_macs:
+                isolated_macs.setdefault(mac, None)
+        return cls(dpids, isolated_macs)
+
+
+class TopologySnapshot(Snapshot):
+    """
+    Devices and flow table taken together, so nodes, isolation flags and edges are consistent.
+    """
+
+    def __init__(self, device_snapshot, flow_snapshot):
+        super().__init__()
+        self.device_snapshot = device_snapshot
+        self.flow_snapshot = flow_snapshot
+        self.fetched_at = min(device_snapshot.fetched_at, flow_snapshot.fetched_at)
+
+        # Both versions only grow, so the sum changes whenever one of them does
+        self.version = device_snapshot.version + flow_snapshot.version
+        self.snapshot_id = f"{device_snapshot.version}-{flow_snapshot.version}"
+
+    def nodes(self):
+        """
+        Return the devices, each with a flag whether it is isolated.
+        """
+        isolated = {canonical_mac(mac) for mac in self.flow_snapshot.isolated_macs}
+        return [
+            dict(device, isolated=canonical_mac(device.get("mac") or "") in isolated)
+            for device in self.device_snapshot.devices
+        ]
+
+
+def canonical_mac(mac):
+    """
+    Return a MAC address in lower case with colons as separators.
+    """
+    return mac.strip().lower().replace("-", ":")
+
+
+def is_isolation_flow(flow):
+    """
+    Return whether a flow isolates a device.
+    """
+    # If the actions list is empty and dl_src is present, consider it as an isolated device
+    match = flow.get("match") or {}
+    return not flow.get("actions", []) and "dl_src" in match
+
+
+class _Flight:
+    """
+    A fetch in progress, shared by every requester that arrives while it runs.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SnapshotCache:
+    """
+    Cache for a single snapshot with a TTL and single-flight fetching.
+
+    If the snapshot is missing or older than `ttl` seconds, the first requester calls
+    `fetch` and all concurrent requesters wait for its result instead of fetching
+    themselves. Errors are passed to every waiting requester and are not cached.
+
+    A fetch that was already running when the cache was invalidated may have read the
+    old state, its result is returned to its requesters but not cached.
+    """
+
+    def __init__(self, fetch, ttl=5):
+        self.fetch = fetch
+        self.ttl = ttl
+
+        self._snapshot = None
+        self._fetched_at = 0.0
+        self._flight = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return the cached snapshot, fetching a new one if it is missing or expired.
+        """
+        with self._lock:
+            if self._snapshot is not None and not self._expired():
+                return self._snapshot
+
+            leader = self._flight is None
+            if leader:
+                self._flight = _Flight()
+            flight = self._flight
+            generation = self._generation
+
+        if leader:
+            try:
+                flight.result = self.fetch()
+            except Exception as error:
+                flight.error = error
+            finally:
+                with self._lock:
+                    if flight.error is None and generation == self._generation:
+                        self._snapshot = flight.result
+                        self._fetched_at = time.monotonic()
+                    if self._flight is flight:
+                        self._flight = None
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def invalidate(self):
+        """
+        Drop the cached snapshot, e.g. after the upstream state was changed.
+
+        Requesters arriving afterwards don't wait for a fetch that was already running.
+        """
+        with self._lock:
+            self._snapshot = None
+            self._fetched_at = 0.0
+            self._flight = None
+            self._generation += 1
+
+    def _expired(self):
+        return time.monotonic() - self._fetched_at >= self.ttl
+
+
+class AsyncSnapshotCache:
+    """
+    Variant of SnapshotCache for the asyncio server, `fetch` is a coroutine function.
+
+    Concurrent requesters await the same task. A TTL of 0 only merges concurrent fetches.
+    """
+
+    def __init__(self, fetch, ttl=5):
+        self.fetch = fetch
+        self.ttl = ttl
+
+        self._snapshot = None
+        self._fetched_at = 0.0
+        self._task = None
+        self._generation = 0
+        self._loop = None
+
+    async def get(self):
+        """
+        Return the cached snapshot, fetching a new one if it is missing or expired.
+        """
+        self._loop = asyncio.get_running_loop()
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._fetched_at < self.ttl:
+            return snapshot
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+        # A cancelled requester must not cancel the fetch of the others
+        return await asyncio.shield(self._task)
+
+    def invalidate(self):
+        """
+        Drop the cached snapshot, may be called from any thread.
+
+        Requesters arriving afterwards don't wait for a fetch that was already running.
+        Calls from other threads are handed to the event loop of the requesters.
+        """
+        loop = self._loop
+        if loop is not None and not _runs_on(loop):
+            try:
+                loop.call_soon_threadsafe(self._invalidate)
+                return
+            except RuntimeError:
+                # The event loop was closed, nobody can be waiting on it anymore
+                pass
+        self._invalidate()
+
+    def _invalidate(self):
+        self._generation += 1
+        self._snapshot = None
+        self._fetched_at = 0.0
+        self._task = None
+
+    async def _run(self):
+        generation = self._generation
+        try:
+            snapshot = await self.fetch()
+            # A fetch started before the last invalidation may have read the old state
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self._fetched_at = time.monotonic()
+            return snapshot
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
+
+
+def _runs_on(loop):
+    # Whether the caller runs on the given event loop
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
@@ -0,0 +1,223 @@
+"""
+timeseries.py - In-memory history of device metrics in fixed-size ring buffers.
+
+Every series is stored in several tiers of decreasing resolution, by default the raw
+samples, one-minute averages and 15-minute averages. Each tier is a ring buffer of
+preallocated arrays, so recording a sample neither allocates memory nor grows the
+store, and old samples are overwritten once a tier is full.
+
+Metrics recorded together, like the byte and packet rate of a device, share one group
+and one time axis.
+"""
+
+import math
+import threading
+import time
+from array import array
+
+# (resolution in seconds, number of points), a resolution of 0 keeps every sample
+DEFAULT_TIERS = ((0, 360), (60, 720), (900, 672))
+
+
+class _Tier:
+    """
+    Ring buffer of one resolution, averaging the samples of each interval.
+    """
+
+    def __init__(self, resolution, capacity, width):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * capacity))
+        self.values = [array("f", bytes(4 * capacity)) for _ in range(width)]
+        self.next = 0
+        self.count = 0
+
+        # The interval being averaged, written to the buffer once the next one starts
+        self.bucket = None
+        self.sums = [0.0] * width
+        self.samples = 0
+
+    def add(self, timestamp, values):
+        if not self.resolution:
+            self._store(timestamp, values)
+            return
+
+        bucket = timestamp - timestamp % self.resolution
+        if self.bucket is not None and bucket != self.bucket:
+            self._flush()
+        self.bucket = bucket
+        for index, value in enumerate(values):
+            self.sums[index] += value
+        self.samples += 1
+
+    def oldest(self):
+        """
+        Return the time of the oldest point kept, or None if the tier is empty.
+        """
+        if not self.count:
+            return self.bucket
+        return self.times[(self.next - self.count) % self.capacity]
+
+    def points(self, since):
+        """
+        Return the points since the given time, the interval still being averaged included.
+        """
+        points = []
+        for offset in range(self.count):
+            index = (self.next - self.count + offset) % self.capacity
+            if self.times[index] >= since:
+                points.append(
+                    [self.times[index]] + [round(v[index], 3) for v in self.values]
+                )
+        if self.samples and self.bucket >= since:
+            points.append(
+                [self.bucket] + [round(s / self.samples, 3) for s in self.sums]
+            )
+        return points
+
+    def _flush(self):
+        if self.samples:
+            index = self.next
+            self.times[index] = self.bucket
+            for metric, total in enumerate(self.sums):
+                self.values[metric][index] = total / self.samples
+                self.sums[metric] = 0.0
+            self._advance()
+        self.samples = 0
+
+    def _store(self, timestamp, values):
+        index = self.next
+        self.times[index] = timestamp
+        for metric, value in enumerate(values):
+            self.values[metric][index] = value
+        self._advance()
+
+    def _advance(self):
+        self.next = (self.next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+
+class _Series:
+    """
+    All tiers of one group of metrics of one device.
+    """
+
+    def __init__(self, tiers, width):
+        self.tiers = [
+            _Tier(resolution, capacity, width) for resolution, capacity in tiers
+        ]
+        self.updated_at = 0.0
+
+    def add(self, timestamp, values, seen=True):
+        for tier in self.tiers:
+            tier.add(timestamp, values)
+        if seen:
+            self.updated_at = timestamp
+
+    def tier_for(self, since):
+        """
+        Return the finest tier that still holds the points since the given time.
+        """
+        for tier in self.tiers:
+            oldest = tier.oldest()
+            if tier.count < tier.capacity or (oldest is not None and oldest <= since):
+                return tier
+        return self.tiers[-1]
+
+
+class TimeSeriesStore:
+    """
+    Ring-buffered history of metric groups per MAC address.
+
+    `groups` maps a group name to the names of its metrics. Series of devices that were
+    not updated for longer than the coarsest tier covers are dropped.
+    """
+
+    def __init__(self, groups, tiers=DEFAULT_TIERS):
+        self.groups = {name: tuple(metrics) for name, metrics in groups.items()}
+        self.tiers = tuple(tiers)
+
+        self._series = {name: {} for name in self.groups}
+        self._lock = threading.Lock()
+
+        resolution, capacity = self.tiers[-1]
+        self._retention = max(resolution, 1) * capacity
+
+    def record(self, group, timestamp, values):
+        """
+        Add a sample of a group for every MAC in `values`, a dict of MAC to metric values.
+
+        Devices with a series but without a value are recorded as 0, e.g. a device
+        that stopped sending.
+        """
+        width = len(self.groups[group])
+        zeros = (0.0,) * width
+        with self._lock:
+            series = self._series[group]
+            for mac, metric_values in values.items():
+                entry = series.get(mac)
+                if entry is None:
+                    entry = series[mac] = _Series(self.tiers, width)
+                entry.add(timestamp, metric_values)
+
+            for mac, entry in list(series.items()):
+                if mac in values:
+                    continue
+                if timestamp - entry.updated_at > self._retention:
+                    del series[mac]
+                else:
+                    entry.add(timestamp, zeros, seen=False)
+
+    def query(self, mac, window, now=None):
+        """
+        Return the points of every metric of a MAC within the last `window` seconds.
+
+        Each metric is answered from the finest tier that covers the window.
+        """
+        since = (time.time() if now is None else now) - window
+        result = {}
+        with self._lock:
+            for group, metrics in self.groups.items():
+                entry = self._series[group].get(mac)
+                if entry is None:
+                    continue
+                tier = entry.tier_for(since)
+                points = tier.points(since)
+                for index, metric in enumerate(metrics):
+                    result[metric] = {
+                        "resolution": tier.resolution,
+                        "points": [[point[0], point[index + 1]] for point in points],
+                    }
+        return result
+
+    def stats(self):
+        """
+        Return the number of series and the bytes preallocated for them.
+        """
+        with self._lock:
+            count = sum(len(series) for series in self._series.values())
+            size = 0
+            for group, series in self._series.items():
+                width = len(self.groups[group])
+                per_series = sum(
+                    capacity * (8 + 4 * width) for _, capacity in self.tiers
+                )
+                size += per_series * len(series)
+        return {"series": count, "bytes": size}
+
+
+def parse_window(value, default=3600):
+    """
+    Parse a time window like "90", "15m", "6h" or "7d" into seconds.
+
+    Raises ValueError for malformed values.
+    """
+    if not value:
+        return default
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    factor = units.get(value[-1].lower())
+    number = value[:-1] if factor else value
+    seconds = float(number) * (factor or 1)
+    if seconds <= 0 or math.isinf(seconds) or math.isnan(seconds):
+        raise ValueError(f"Invalid window: {value}")
+    return seconds
@@ -0,0 +1,269 @@
+"""
+topology_diff.py - Changes between consecutive device and flow snapshots.
+
+Every new snapshot is compared with the previous one of its kind exactly once. The
+result holds the records added, removed and changed, used for ?since= deltas and the
+persistent history, and typed changes like a device appearing or an IP address
+changing, used for the event stream. Consumers subscribe to the engine instead of
+comparing snapshots themselves.
+
+Records are indexed by their key once per snapshot and compared with dict and set
+operations, so a comparison is linear in the size of the snapshots.
+"""
+
+import threading
+from collections import namedtuple
+
+from changelog import ADDED, CHANGED, REMOVED
+from snapshots import canonical_mac
+
+DEVICE_APPEARED = "device-appeared"
+DEVICE_DISAPPEARED = "device-disappeared"
+IP_CHANGED = "ip-changed"
+HOSTNAME_CHANGED = "hostname-changed"
+REACHABILITY_CHANGED = "reachability-changed"
+COMMUNICATION_ADDED = "communication-added"
+ISOLATION_ADDED = "isolation-added"
+ISOLATION_REMOVED = "isolation-removed"
+
+# A typed change of one device, `data` is the payload sent to clients
+Change = namedtuple("Change", "type mac data")
+
+
+class Diff:
+    """
+    Changes between two snapshots of the same kind.
+
+    `records` maps the key of every added, removed or changed record to (kind, record).
+    `initial` is set if there was no previous snapshot, then all records count as added
+    and no typed changes are reported.
+    """
+
+    def __init__(self, initial, records, changes):
+        self.initial = initial
+        self.records = records
+        self.changes = changes
+
+
+def device_key(device):
+    """
+    Return the key of a device record, a MAC can be listed with several addresses.
+    """
+    return (canonical_mac(device.get("mac") or ""), device.get("ip"))
+
+
+def communication_key(communication):
+    """
+    Return the key of a communication record.
+    """
+    return (
+        canonical_mac(communication["source_mac"]),
+        canonical_mac(communication["destination_mac"]),
+        communication["dpid"],
+    )
+
+
+def device_records(snapshot):
+    """
+    Return the device records of a snapshot by key, built once per snapshot.
+    """
+    return snapshot.memo(
+        "device_records", lambda: {device_key(d): d for d in snapshot.devices}
+    )
+
+
+def communication_records(snapshot):
+    """
+    Return the communication records of a snapshot by key, built once per snapshot.
+    """
+    return snapshot.memo(
+        "communication_records",
+        lambda: {communication_key(c): c for c in snapshot.communications},
+    )
+
+
+def devices_by_mac(snapshot):
+    """
+    Return one record per MAC of a device snapshot, built once per snapshot.
+
+    The first record of a MAC is extended by all its addresses in `ips` and the first
+    hostname reported. It counts as reachable if any of its addresses is.
+    """
+    return snapshot.memo("devices_by_mac", lambda: _merge_by_mac(snapshot.devices))
+
+
+def diff_devices(previous, current):
+    """
+    Compare two device snapshots, `previous` may be None.
+    """
+    after = device_records(current)
+    if previous is None:
+        return Diff(True, _all_added(after), [])
+
+    records = _diff_records(device_records(previous), after)
+    changes = []
+    if records:
+        before_macs = devices_by_mac(previous)
+        after_macs = devices_by_mac(current)
+        # Only MACs with a changed record can have a typed change
+        for mac in sorted({key[0] for key in records}):
+            changes.extend(
+                _device_changes(mac, before_macs.get(mac), after_macs.get(mac))
+            )
+    return Diff(False, records, changes)
+
+
+def diff_flows(previous, current):
+    """
+    Compare two flow snapshots, `previous` may be None.
+    """
+    after = communication_records(current)
+    if previous is None:
+        return Diff(True, _all_added(after), [])
+
+    records = _diff_records(communication_records(previous), after)
+    changes = []
+
+    isolated_before = _isolated(previous)
+    isolated_after = _isolated(current)
+    for mac in sorted(isolated_after - isolated_before):
+        changes.append(Change(ISOLATION_ADDED, mac, {"mac": mac, "isolated": True}))
+    for mac in sorted(isolated_before - isolated_after):
+        changes.append(Change(ISOLATION_REMOVED, mac, {"mac": mac, "isolated": False}))
+
+    # A pair is new if it was not seen on any datapath before
+    pairs_before = _pairs(previous)
+    reported = set()
+    for key, (kind, communication) in records.items():
+        pair = key[:2]
+        if kind == ADDED and pair not in pairs_before and pair not in reported:
+            reported.add(pair)
+            changes.append(Change(COMMUNICATION_ADDED, pair[0], communication))
+
+    return Diff(False, records, changes)
+
+
+class DiffEngine:
+    """
+    Compares every published snapshot with the previous one of its kind.
+
+    Listeners are called with (snapshot, diff) in the order the snapshots were
+    published. Snapshots of one kind are compared one at a time, so listeners see every
+    snapshot exactly once and against the snapshot they saw before.
+    """
+
+    DIFFERS = {"devices": diff_devices, "flows": diff_flows}
+
+    def __init__(self):
+        self._previous = {kind: None for kind in self.DIFFERS}
+        self._listeners = {kind: [] for kind in self.DIFFERS}
+        self._locks = {kind: threading.Lock() for kind in self.DIFFERS}
+
+    def subscribe(self, kind, listener):
+        """
+        Call `listener(snapshot, diff)` for every published snapshot of a kind.
+        """
+        self._listeners[kind].append(listener)
+
+    def publish(self, kind, snapshot):
+        """
+        Compare a snapshot with the previous one of its kind and notify the listeners.
+        """
+        with self._locks[kind]:
+            diff = self.DIFFERS[kind](self._previous[kind], snapshot)
+            self._previous[kind] = snapshot
+            for listener in self._listeners[kind]:
+                try:
+                    listener(snapshot, diff)
+                except Exception as error:
+                    print(f"Failed to process the {kind} changes: {error}")
+        return diff
+
+
+def _diff_records(before, after):
+    records = {}
+    for key, record in after.items():
+        old = before.get(key)
+        if old is None:
+            records[key] = (ADDED, record)
+        elif old != record:
+            records[key] = (CHANGED, record)
+    for key in before.keys() - after.keys():
+        records[key] = (REMOVED, before[key])
+    return records
+
+
+def _all_added(records):
+    return {key: (ADDED, record) for key, record in records.items()}
+
+
+def _device_changes(mac, old, new):
+    if old is None and new is None:
+        return []
+    if old is None:
+        return [Change(DEVICE_APPEARED, mac, new)]
+    if new is None:
+        return [Change(DEVICE_DISAPPEARED, mac, old)]
+
+    changes = []
+    if old["ips"] != new["ips"]:
+        changes.append(
+            Change(
+                IP_CHANGED,
+                mac,
+                {"mac": mac, "ips": new["ips"], "previous_ips": old["ips"]},
+            )
+        )
+    if old.get("hostname") != new.get("hostname"):
+        changes.append(
+            Change(
+                HOSTNAME_CHANGED,
+                mac,
+                {
+                    "mac": mac,
+                    "hostname": new.get("hostname"),
+                    "previous_hostname": old.get("hostname"),
+                },
+            )
+        )
+    if bool(old.get("reachable")) != bool(new.get("reachable")):
+        changes.append(
+            Change(
+                REACHABILITY_CHANGED,
+                mac,
+                {"mac": mac, "reachable": new.get("reachable")},
+            )
+        )
+    return changes
+
+
+def _merge_by_mac(devices):
+    result = {}
+    for device in devices:
+        mac = canonical_mac(device.get("mac") or "")
+        merged = result.get(mac)
+        if merged is None:
+            merged = result[mac] = dict(device, ips=[])
+        if device.get("ip") and device["ip"] not in merged["ips"]:
+            merged["ips"].append(device["ip"])
+        if not merged.get("hostname") and device.get("hostname"):
+            merged["hostname"] = device["hostname"]
+        if device.get("reachable"):
+            merged["reachable"] = device["reachable"]
+
+    for merged in result.values():
+        merged["ips"].sort()
+    return result
+
+
+def _isolated(snapshot):
+    return snapshot.memo(
+        "isolated_set", lambda: {canonical_mac(mac) for mac in snapshot.isolated_macs}
+    )
+
+
+def _pairs(snapshot):
+    return snapshot.memo(
+        "communication_pairs",
+        lambda: {key[:2] for key in communication_records(snapshot)},
+    )
@@ -0,0 +1,169 @@
+"""
+traffic.py - Traffic counters and rates of communicating device pairs.
+
+Ryu reports packet and byte counters for every flow. The counters of all flows between
+two devices are added up per datapath, and rates are computed from two successive
+snapshots of the same datapath.
+
+Counters start again at zero when a flow is removed and learned again, e.g. after an
+idle timeout. Such flows are recognized by a smaller duration or smaller counters than
+in the previous snapshot; for them only the traffic since the new installation counts.
+"""
+
+from snapshots import canonical_mac
+
+PACKET_COUNT = "packet_count"
+BYTE_COUNT = "byte_count"
+PACKET_RATE = "packets_per_second"
+BYTE_RATE = "bytes_per_second"
+TRAFFIC_FIELDS = (PACKET_COUNT, BYTE_COUNT, PACKET_RATE, BYTE_RATE)
+
+# duration_sec is truncated to full seconds by the switch
+DURATION_TOLERANCE = 1
+
+
+def snapshot_traffic(snapshot):
+    """
+    Return the traffic records of a flow snapshot keyed by (source MAC, destination MAC, DPID).
+
+    Built once per snapshot. Rates are None for datapaths without an earlier snapshot.
+    """
+    return snapshot.memo("traffic", lambda: _build_traffic(snapshot))
+
+
+def _build_traffic(snapshot):
+    traffic = {}
+    for dpid, part in snapshot.per_datapath().items():
+        for pair, counters in pair_counters(part.flow_counters).items():
+            rates = None
+            if part.rates is not None:
+                rates = part.rates.get(pair, (0.0, 0.0))
+            traffic[(pair[0], pair[1], dpid)] = traffic_record(counters, rates)
+    return traffic
+
+
+def device_rates(traffic):
+    """
+    Return (bytes per second, packets per second) of every device, to and from all peers.
+
+    Pairs without rates are skipped. As in peer_traffic, the busiest datapath is reported.
+    """
+    per_datapath = {}
+    for (src_mac, dst_mac, dpid), record in traffic.items():
+        if record[BYTE_RATE] is None:
+            continue
+        for mac in {src_mac, dst_mac}:
+            total = per_datapath.setdefault((mac, dpid), [0.0, 0.0])
+            total[0] += record[BYTE_RATE]
+            total[1] += record[PACKET_RATE]
+
+    rates = {}
+    for (mac, _), (octets, packets) in per_datapath.items():
+        best = rates.get(mac)
+        if best is None or octets > best[0]:
+            rates[mac] = (octets, packets)
+    return rates
+
+
+def pair_counters(flow_counters):
+    """
+    Add up the counters of all flows of a datapath per (source MAC, destination MAC).
+    """
+    totals = {}
+    for (src_mac, dst_mac, _), (packets, octets, _) in flow_counters.items():
+        pair = (canonical_mac(src_mac), canonical_mac(dst_mac))
+        total = totals.get(pair)
+        if total is None:
+            totals[pair] = [packets, octets]
+        else:
+            total[0] += packets
+            total[1] += octets
+    return totals
+
+
+def compute_rates(previous, current):
+    """
+    Return the packet and byte rate per pair between two flow snapshots of one datapath.
+
+    Returns None if the snapshots are not in order, e.g. if no earlier snapshot exists.
+    """
+    elapsed = current.fetched_at - previous.fetched_at
+    if elapsed <= 0:
+        return None
+
+    deltas = {}
+    for key, (packets, octets, duration) in current.flow_counters.items():
+        old = previous.flow_counters.get(key)
+        if (
+            old is not None
+            and duration >= old[2]
+            and packets >= old[0]
+            and octets >= old[1]
+        ):
+            delta = (packets - old[0], octets - old[1])
+        elif duration <= elapsed + DURATION_TOLERANCE:
+            # New or re-installed since the previous snapshot, all of its traffic is new
+            delta = (packets, octets)
+        else:
+            # Unknown before, but older than the interval, its traffic can't be attributed
+            delta = (0, 0)
+
+        pair = (canonical_mac(key[0]), canonical_mac(key[1]))
+        total = deltas.get(pair)
+        if total is None:
+            deltas[pair] = list(delta)
+        else:
+            total[0] += delta[0]
+            total[1] += delta[1]
+
+    return {
+        pair: (packets / elapsed, octets / elapsed)
+        for pair, (packets, octets) in deltas.items()
+    }
+
+
+def traffic_record(counters, rates):
+    """
+    Return the traffic fields of a pair from its counters and rates, rates may be None.
+    """
+    packets, octets = counters
+    return {
+        PACKET_COUNT: packets,
+        BYTE_COUNT: octets,
+        PACKET_RATE: round(rates[0], 3) if rates is not None else None,
+        BYTE_RATE: round(rates[1], 3) if rates is not None else None,
+    }
+
+
+def peer_traffic(traffic, mac):
+    """
+    Return the traffic of a device with each of its peers, in both directions.
+
+    `traffic` maps (source MAC, destination MAC, DPID) to traffic records. The directions
+    are added up per datapath. Traffic that passed several datapaths is counted on each,
+    so the busiest datapath is reported.
+    """
+    mac = canonical_mac(mac)
+    per_datapath = {}
+    for (src_mac, dst_mac, dpid), record in traffic.items():
+        if src_mac == mac:
+            peer = dst_mac
+        elif dst_mac == mac:
+            peer = src_mac
+        else:
+            continue
+
+        total = per_datapath.setdefault((peer, dpid), dict.fromkeys(record, 0))
+        for field, value in record.items():
+            if value is None or total[field] is None:
+                total[field] = None
+            else:
+                total[field] += value
+
+    peers = {}
+    for (peer, _), record in per_datapath.items():
+        best = peers.get(peer)
+        if best is None or record[BYTE_COUNT] > best[BYTE_COUNT]:
+            peers[peer] = record
+
+    return [dict(record, mac=peer) for peer, record in sorted(peers.items())]
@@ -57,17 +57,21 @@ export async function generateView(htmlSource, config) {
 
     // Select the correct devices to be displayed. Used for the demo network
     let devices;
-
-    devices = !config.isDemo
-        ? (config.mode === "physical"
-            ? await network.getDevicesPhysical(openWrtIP)
-            : await network.getDevicesSdn(openWrtIP))
-        : (config.mode === "physical"
+    let isolatedDevices;
+
+    if (!config.isDemo) {
+        // Devices and isolated devices come from one consistent server response
+        let topology = await network.getTopology(openWrtIP, mode, graphForce);
+        devices = topology.devices;
+        isolatedDevices = topology.isolatedDevices;
+    } else {
+        devices = config.mode === "physical"
             ? await network.getSmallNetwork() // Change here for testing larger networks
-            : await network.getDemoSdn());
+            : await network.getDemoSdn();
 
-    // Get the already isolated devices
-    let isolatedDevices = await network.getIsolatedDevices();
+        // Get the already isolated devices
+        isolatedDevices = await network.getIsolatedDevices();
+    }
 
     try {
         devices.forEach((device) => {
@@ -91,6 +95,8 @@ export async function generateView(htmlSource, config) {
                 ip: ip,
                 mac: mac,
                 reachable: reachable,
+                x: device.x,
+                y: device.y,
             });
 
             data.links.push({ source: host, target: ip, marked: false });
@@ -175,8 +181,15 @@ export async function generateView(htmlSource, config) {
         .force("y", d3.forceY().y((d) => Math.max(0, Math.min(graphHeight, d.y))).strength(0.1))
         .on("tick", ticked);
 
-    simulation.alpha(1);
-    for (var i = 0; i < 50; ++i) simulation.tick();
+    // Positions computed by the server are drawn as they are, otherwise the layout is simulated here
+    const positioned = data.nodes.length > 0 && data.nodes.every((node) => node.x !== undefined && node.y !== undefined);
+    if (positioned) {
+        simulation.stop();
+        ticked();
+    } else {
+        simulation.alpha(1);
+        for (var i = 0; i < 50; ++i) simulation.tick();
+    }
 
     let drag = d3
         .drag()
@@ -534,17 +547,25 @@ export async function generateView(htmlSource, config) {
     // Renders the network flow between devices
     async function showCommunication(selectedMac) {
         try {
-            let communications = config.isDemo ? await network.getDemoCommunications() : await network.getCommunications();
             let linkedIdentifiers = [];
 
-            // Get the connected MAC's
-            for (let communication of communications) {
+            if (config.isDemo) {
+                let communications = await network.getDemoCommunications();
+
+                // Get the connected MAC's
+                for (let communication of communications) {
 
-                if (communication.sourceMac.toUpperCase() === selectedMac) {
-                    linkedIdentifiers.push(communication.destinationMac);
-                } else if (communication.destinationMac.toUpperCase() === selectedMac) {
-                    linkedIdentifiers.push(communication.sourceMac);
+                    if (communication.sourceMac.toUpperCase() === selectedMac) {
+                        linkedIdentifiers.push(communication.destinationMac);
+                    } else if (communication.destinationMac.toUpperCase() === selectedMac) {
+                        linkedIdentifiers.push(communication.sourceMac);
+                    }
                 }
+            } else {
+                // The server looks up the partners of the MAC in its index
+                let partners = await network.getCommunicationPartners(selectedMac);
+                linkedIdentifiers = partners.map((partner) => partner.mac);
+                showTraffic(partners);
             }
 
             // Highlight nodes
@@ -563,6 +584,27 @@ export async function generateView(htmlSource, config) {
         }
     }
 
+    // Size the links of the communication partners by the traffic exchanged with them
+    function showTraffic(partners) {
+        let traffic = {};
+        for (let partner of partners) {
+            traffic[partner.mac] = partner.bytes_per_second != null ? partner.bytes_per_second : partner.byte_count;
+        }
+        let maxTraffic = Math.max(...Object.values(traffic), 0);
+
+        graphSvg
+            .selectAll("line")
+            .filter((link) => link.target.mac && link.target.mac.toLowerCase() in traffic)
+            .transition()
+            .duration(duration)
+            .style("stroke", linkHighlighted)
+            .attr("stroke-width", (link) => {
+                let share = maxTraffic > 0 ? traffic[link.target.mac.toLowerCase()] / maxTraffic : 1;
+                return linkWidthDefault + (linkWidthHighlighted - linkWidthDefault) * share;
+            })
+            .attr("marked", "true");
+    }
+
     // Returns the IP of a node or a row
     function getIP(element) {
         if (element.ip) {
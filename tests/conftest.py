@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The server modules import each other by their plain names
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "python"))
@@ -0,0 +1,64 @@
+from changelog import ADDED, CHANGED, REMOVED, ChangeLog
+
+
+def published(max_versions=100):
+    log = ChangeLog(max_versions=max_versions)
+    log.publish_changes({"a": (ADDED, {"id": "a"}), "b": (ADDED, {"id": "b"})})
+    log.publish_changes({"a": (CHANGED, {"id": "a", "value": 1})})
+    log.publish_changes({"b": (REMOVED, {"id": "b"}), "c": (ADDED, {"id": "c"})})
+    return log
+
+
+def test_changes_between_versions():
+    log = published()
+
+    assert log.version == 3
+    assert log.changes(1, 3) == {
+        ADDED: [{"id": "c"}],
+        REMOVED: [{"id": "b"}],
+        CHANGED: [{"id": "a", "value": 1}],
+    }
+
+
+def test_changes_from_the_beginning():
+    log = published()
+
+    # A record added and removed again within the range is not reported
+    assert log.changes(0, 3) == {
+        ADDED: [{"id": "a", "value": 1}, {"id": "c"}],
+        REMOVED: [],
+        CHANGED: [],
+    }
+
+
+def test_same_version_has_no_changes():
+    log = published()
+
+    assert log.changes(3, 3) == {ADDED: [], REMOVED: [], CHANGED: []}
+
+
+def test_empty_publish_keeps_the_version():
+    log = published()
+
+    assert log.publish_changes({}) == 3
+
+
+def test_versions_no_longer_in_the_log_are_unknown():
+    log = published(max_versions=2)
+
+    assert log.changes(0, 3) is None
+    assert log.changes(0, 0) == {ADDED: [], REMOVED: [], CHANGED: []}
+    assert log.changes(1, 3) == {
+        ADDED: [{"id": "c"}],
+        REMOVED: [{"id": "b"}],
+        CHANGED: [{"id": "a", "value": 1}],
+    }
+
+
+def test_future_versions_are_unknown():
+    log = published()
+
+    assert log.changes(4, 4) is None
+    assert log.changes(2, 4) is None
+    assert log.changes(5, 3) is None
+    assert log.changes(-5, 3) is None
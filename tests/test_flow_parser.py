@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from flow_parser import iter_flows
+
+FLOWS = {
+    "1": [
+        {
+            "priority": 1,
+            "match": {"in_port": 1, "dl_src": "aa:aa:aa:aa:aa:01", "dl_dst": "ü"},
+            "actions": ["OUTPUT:2"],
+            "packet_count": 3,
+            "byte_count": 300,
+            "duration_sec": 7,
+            "cookie": 0,
+        },
+        {"match": {}, "actions": [], "packet_count": 0},
+    ],
+    "2": [{"match": {"in_port": 4}, "actions": ["OUTPUT:1"]}],
+    "3": [],
+}
+
+EXPECTED = [
+    {
+        "match": {"in_port": 1, "dl_src": "aa:aa:aa:aa:aa:01", "dl_dst": "ü"},
+        "actions": ["OUTPUT:2"],
+        "packet_count": 3,
+        "byte_count": 300,
+        "duration_sec": 7,
+    },
+    {"match": {}, "actions": [], "packet_count": 0},
+]
+
+
+def split(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 100000])
+def test_flows_split_across_chunks(size):
+    data = json.dumps(FLOWS, indent=1, ensure_ascii=False).encode("utf-8")
+
+    assert list(iter_flows(split(data, size), 1)) == EXPECTED
+    assert list(iter_flows(split(data, size), "2")) == [
+        {"match": {"in_port": 4}, "actions": ["OUTPUT:1"]}
+    ]
+    assert list(iter_flows(split(data, size), 3)) == []
+
+
+def test_empty_dump():
+    assert list(iter_flows([b" {", b"} "], 1)) == []
+
+
+@pytest.mark.parametrize("size", [1, 5, 100000])
+def test_truncated_dump(size):
+    data = json.dumps(FLOWS, ensure_ascii=False).encode("utf-8")
+
+    for end in range(len(data)):
+        with pytest.raises(ValueError):
+            list(iter_flows(split(data[:end], size), 9))
+
+
+def test_malformed_dump():
+    with pytest.raises(ValueError):
+        list(iter_flows([b'{"1": [{"match": {}} {"match": {}}]}'], 1))
+    with pytest.raises(ValueError):
+        list(iter_flows([b'["1"]'], 1))
@@ -0,0 +1,67 @@
+import threading
+
+from jobs import FAILED, SUCCEEDED, JobQueue
+
+TIMEOUT = 5
+
+
+def succeed():
+    return {"status": "success"}
+
+
+def test_jobs_on_the_same_mac_run_in_submission_order():
+    jobs = JobQueue(workers=4)
+    release = threading.Event()
+    order = []
+
+    def run(name, wait=None):
+        def job():
+            if wait is not None:
+                assert wait.wait(TIMEOUT)
+            order.append(name)
+            return {"status": "success"}
+
+        return job
+
+    isolate = jobs.submit("isolate", ["AA:AA:AA:AA:AA:01"], run("isolate", release))
+    include = jobs.submit("include", ["aa-aa-aa-aa-aa-01"], run("include"))
+    other = jobs.submit("isolate", ["aa:aa:aa:aa:aa:02"], run("other"))
+
+    assert include.depends_on == [isolate]
+    assert other.depends_on == []
+
+    # The unrelated job doesn't wait for the blocked one
+    assert other.done.wait(TIMEOUT)
+    assert not include.done.is_set()
+
+    release.set()
+    assert include.done.wait(TIMEOUT)
+    assert order == ["other", "isolate", "include"]
+    assert jobs.get(include.id)["status"] == SUCCEEDED
+
+
+def test_finished_jobs_are_evicted_oldest_first():
+    jobs = JobQueue(workers=1, history_size=2)
+    release = threading.Event()
+
+    def blocked():
+        assert release.wait(TIMEOUT)
+        return {"status": "error"}
+
+    first = jobs.submit("isolate", ["aa:aa:aa:aa:aa:01"], blocked)
+    second = jobs.submit("include", ["aa:aa:aa:aa:aa:01"], succeed)
+    third = jobs.submit("include", ["aa:aa:aa:aa:aa:02"], succeed)
+
+    # The oldest job is still running, so it is kept beyond the history size
+    assert jobs.stats()["kept"] == 3
+    assert jobs.get(first.id)["status"] in ("queued", "running")
+
+    release.set()
+    assert third.done.wait(TIMEOUT)
+    assert jobs.get(first.id)["status"] == FAILED
+
+    fourth = jobs.submit("isolate", ["aa:aa:aa:aa:aa:03"], succeed)
+    assert jobs.get(first.id) is None
+    assert jobs.get(second.id) is None
+    assert jobs.get(third.id)["status"] == SUCCEEDED
+    assert jobs.get(fourth.id) is not None
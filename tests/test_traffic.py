@@ -0,0 +1,62 @@
+from snapshots import FlowSnapshot
+from traffic import compute_rates
+
+SRC = "AA:AA:AA:AA:AA:01"
+DST = "aa:aa:aa:aa:aa:02"
+
+
+def flow_snapshot(fetched_at, packets, octets, duration):
+    flow = {
+        "match": {"in_port": 1, "dl_src": SRC, "dl_dst": DST},
+        "packet_count": packets,
+        "byte_count": octets,
+        "duration_sec": duration,
+    }
+    snapshot = FlowSnapshot(1, [flow])
+    snapshot.fetched_at = fetched_at
+    return snapshot
+
+
+def test_rates_of_a_growing_counter():
+    previous = flow_snapshot(100.0, 10, 1000, 50)
+    current = flow_snapshot(110.0, 30, 3000, 60)
+
+    rates = compute_rates(previous, current)
+
+    assert rates == {(SRC.lower(), DST): (2.0, 200.0)}
+
+
+def test_reinstalled_flow_counts_its_traffic_since_installation():
+    # The flow timed out and was learned again 4 seconds ago, its counters restarted
+    previous = flow_snapshot(100.0, 500, 50000, 300)
+    current = flow_snapshot(110.0, 20, 2000, 4)
+
+    rates = compute_rates(previous, current)
+
+    assert rates == {(SRC.lower(), DST): (2.0, 200.0)}
+
+
+def test_smaller_counters_with_longer_duration_are_a_reset():
+    previous = flow_snapshot(100.0, 500, 50000, 3)
+    current = flow_snapshot(110.0, 10, 1000, 8)
+
+    rates = compute_rates(previous, current)
+
+    assert rates == {(SRC.lower(), DST): (1.0, 100.0)}
+
+
+def test_old_flow_missing_before_is_not_attributed_to_the_interval():
+    previous = FlowSnapshot(1, [])
+    previous.fetched_at = 100.0
+    current = flow_snapshot(110.0, 500, 50000, 300)
+
+    rates = compute_rates(previous, current)
+
+    assert rates == {(SRC.lower(), DST): (0.0, 0.0)}
+
+
+def test_snapshots_out_of_order_have_no_rates():
+    previous = flow_snapshot(110.0, 10, 1000, 50)
+    current = flow_snapshot(110.0, 30, 3000, 60)
+
+    assert compute_rates(previous, current) is None